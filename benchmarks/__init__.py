@@ -0,0 +1,4 @@
+""" Benchmarks for building, validating and resolving dependency graphs.
+
+Run them with `python -m benchmarks --help`.
+"""
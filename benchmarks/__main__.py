@@ -0,0 +1,6 @@
+from __future__ import absolute_import
+import sys
+
+from benchmarks.run import main
+
+sys.exit(main())
@@ -0,0 +1,69 @@
+""" Generators for synthetic dependency graphs.
+
+Each generator returns a dict mapping a name to the list of names it depends on,
+which is the format `injector.graph.DependencyGraph` takes.
+"""
+from __future__ import absolute_import
+import random
+
+def _name(i):
+    return 'n{}'.format(i)
+
+def wide(size):
+    """ One node that depends on all the others. """
+    graph = {_name(i): [] for i in range(1, size)}
+    graph[_name(0)] = [_name(i) for i in range(1, size)]
+    return graph
+
+def chain(size):
+    """ Each node depends on the next one. """
+    graph = {_name(i): [_name(i + 1)] for i in range(size - 1)}
+    graph[_name(size - 1)] = []
+    return graph
+
+def diamonds(size):
+    """ A stack of diamonds: each top node depends on two nodes, which both depend
+    on the top node of the next diamond. """
+    graph = {}
+    for i in range(0, size, 3):
+        top = _name(i)
+        sides = [_name(j) for j in (i + 1, i + 2) if j < size]
+        graph[top] = sides
+        below = [_name(i + 3)] if i + 3 < size else []
+        for side in sides:
+            graph[side] = below
+    return graph
+
+def random_dag(size, degree=3, seed=0):
+    """ Each node depends on up to `degree` randomly chosen nodes with lower numbers. """
+    rng = random.Random(seed)
+    graph = {}
+    for i in range(size):
+        count = min(i, degree)
+        graph[_name(i)] = [_name(j) for j in rng.sample(range(i), count)] if count else []
+    return graph
+
+def cyclic(size, degree=3, seed=0):
+    """ A random DAG, plus a chain of edges back through every node so that the
+    whole graph forms one cycle. """
+    graph = random_dag(size, degree, seed)
+    for i in range(size):
+        previous = _name(i - 1 if i else size - 1)
+        if previous not in graph[_name(i)]:
+            graph[_name(i)].append(previous)
+    return graph
+
+SHAPES = {
+    'wide': wide,
+    'chain': chain,
+    'diamonds': diamonds,
+    'random': random_dag,
+    'cyclic': cyclic,
+}
+
+def roots(graph):
+    """ Lists the nodes that nothing depends on. """
+    depended_on = set()
+    for dependencies in graph.values():
+        depended_on.update(dependencies)
+    return sorted(name for name in graph if name not in depended_on)
@@ -0,0 +1,208 @@
+""" Times the main operations of the injector on synthetic graphs.
+
+Results are written as JSON, in the form
+{"python": "...", "results": {"<shape>/<size>/<benchmark>": seconds}}, and can be
+compared against a saved baseline to catch regressions. The 'peak_memory' benchmarks
+are in bytes rather than seconds.
+"""
+from __future__ import absolute_import
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from benchmarks import graphs
+from injector.dependencies import Dependencies
+from injector.exceptions import CircularDependencyException
+from injector.graph import DependencyGraph
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+INJECT_CALLS = 10000
+CHILD_INJECTORS = 10000
+
+def _factory(*args):
+    return len(args)
+
+def _best_time(function, setup=None, repeat=3):
+    """ Runs `function(setup())` `repeat` times, returning the fastest time in seconds. """
+    best = None
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        function(arg)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def _peak_memory(function):
+    """ Runs `function()`, returning the most memory it had allocated at once in bytes. """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _make_dependencies(graph):
+    dependencies = Dependencies()
+    for name, names in graph.items():
+        dependencies.register_factory(name, _factory, dependencies=names)
+    return dependencies
+
+def _resolve_all(injector, names):
+    for name in names:
+        injector.get_dependency(name)
+
+def _inject_many(injector, names):
+    for _ in range(INJECT_CALLS):
+        injector.inject(_factory, names)
+
+def _call_many(function):
+    for _ in range(INJECT_CALLS):
+        function()
+
+def _make_children(injector):
+    for _ in range(CHILD_INJECTORS):
+        injector.child()
+
+def run_graph(graph, repeat=3):
+    """ Times each benchmark on one graph.
+
+    :param graph: A dict mapping a name to the list of names it depends on
+    :param repeat: How many times to run each benchmark (the fastest run is kept)
+    :return: A dict of {benchmark name: seconds}
+    """
+    results = {
+        'has_missing_dependencies': _best_time(
+            lambda g: g.has_missing_dependencies(),
+            setup=lambda: DependencyGraph(graph), repeat=repeat),
+        'has_circular_dependencies': _best_time(
+            lambda g: g.has_circular_dependencies(),
+            setup=lambda: DependencyGraph(graph), repeat=repeat),
+        'validate': _best_time(
+            lambda g: g.validate(),
+            setup=lambda: DependencyGraph(graph), repeat=repeat),
+    }
+    results['register'] = _best_time(lambda _: _make_dependencies(graph), repeat=repeat)
+    build = lambda: _make_dependencies(graph).build_injector()
+    try:
+        results['build_injector'] = _best_time(
+            lambda d: d.build_injector(),
+            setup=lambda: _make_dependencies(graph), repeat=repeat)
+    except CircularDependencyException:
+        return results
+    results['register_and_build'] = _best_time(lambda _: build(), repeat=repeat)
+    results['register_and_build_peak_memory'] = _peak_memory(build)
+
+    roots = graphs.roots(graph)
+    results['get_dependency_cold'] = _best_time(
+        lambda inj: _resolve_all(inj, roots), setup=build, repeat=repeat)
+    # Every name rather than just the roots, so that lookups which stop at values
+    # built by earlier lookups are timed too
+    names = list(graph)
+    results['get_dependency_every_name'] = _best_time(
+        lambda inj: _resolve_all(inj, names), setup=build, repeat=repeat)
+
+    injector = build()
+    _resolve_all(injector, roots)
+    results['get_dependency_warm'] = _best_time(
+        lambda _: _resolve_all(injector, roots), repeat=repeat)
+    results['inject'] = _best_time(
+        lambda _: _inject_many(injector, roots[:10]), repeat=repeat) / INJECT_CALLS
+    bound = injector.bind(_factory, roots[:10])
+    results['bind_call'] = _best_time(
+        lambda _: _call_many(bound), repeat=repeat) / INJECT_CALLS
+    results['child'] = _best_time(
+        lambda _: _make_children(injector), repeat=repeat) / CHILD_INJECTORS
+    return results
+
+def run_suite(shapes=None, sizes=None, repeat=3, log=None):
+    """ Runs the benchmarks on every combination of graph shape and size.
+
+    :param shapes: (optional) A list of names from `graphs.SHAPES` (defaults to all)
+    :param sizes: (optional) A list of graph sizes (defaults to `DEFAULT_SIZES`)
+    :param repeat: How many times to run each benchmark
+    :param log: (optional) A file to write progress to
+    :return: A dict in the JSON result format
+    """
+    results = {}
+    for shape in shapes or sorted(graphs.SHAPES):
+        for size in sizes or DEFAULT_SIZES:
+            if log is not None:
+                log.write('{}/{}\n'.format(shape, size))
+            graph = graphs.SHAPES[shape](size)
+            for benchmark, seconds in run_graph(graph, repeat).items():
+                results['{}/{}/{}'.format(shape, size, benchmark)] = seconds
+    return {
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+def compare(baseline, current, tolerance=0.25):
+    """ Finds the benchmarks that got slower (or used more memory) than the baseline.
+
+    :param baseline: Results in the JSON result format
+    :param current: Results in the JSON result format
+    :param tolerance: How much slower (as a fraction) a benchmark can get before it
+                      counts as a regression
+    :return: A sorted list of (benchmark, baseline result, current result)
+    """
+    regressions = []
+    for benchmark, result in sorted(current['results'].items()):
+        before = baseline['results'].get(benchmark)
+        if before is not None and result > before * (1 + tolerance):
+            regressions.append((benchmark, before, result))
+    return regressions
+
+def format_result(benchmark, value):
+    """ Formats a result with its unit.
+
+    :param benchmark: The name of the benchmark
+    :param value: Its result, in bytes for the 'peak_memory' benchmarks and seconds
+                  otherwise
+    :return: A string
+    """
+    if benchmark.endswith('peak_memory'):
+        return '{} bytes'.format(value)
+    return '{:.6f}s'.format(value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__)
+    parser.add_argument('--shapes', default=','.join(sorted(graphs.SHAPES)),
+                        help='comma-separated graph shapes (default: %(default)s)')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma-separated graph sizes (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per benchmark; the fastest is kept (default: %(default)s)')
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON results to compare against; exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown when comparing (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    current = run_suite(
+        shapes=args.shapes.split(','),
+        sizes=[int(size) for size in args.sizes.split(',')],
+        repeat=args.repeat,
+        log=sys.stderr,
+    )
+    output = json.dumps(current, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, current, args.tolerance)
+        for benchmark, before, after in regressions:
+            sys.stderr.write('REGRESSION {}: {} -> {}\n'.format(
+                benchmark, format_result(benchmark, before), format_result(benchmark, after)))
+        return 1 if regressions else 0
+    return 0
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+#pylint: disable=C0103
+
+from __future__ import absolute_import
+import unittest
+
+from benchmarks import graphs
+from benchmarks.run import compare, format_result, run_graph
+
+class CompareTest(unittest.TestCase):
+    def test_finds_regressions_beyond_tolerance(self):
+        baseline = {'results': {'a': 1.0, 'b': 1.0, 'c/peak_memory': 1000}}
+        current = {'results': {'a': 1.2, 'b': 1.3, 'c/peak_memory': 2000, 'new': 5.0}}
+        self.assertEqual([
+            ('b', 1.0, 1.3),
+            ('c/peak_memory', 1000, 2000),
+        ], compare(baseline, current, tolerance=0.25))
+
+    def test_no_regressions(self):
+        results = {'results': {'a': 1.0}}
+        self.assertEqual([], compare(results, {'results': {'a': 0.5}}))
+
+    def test_format_result(self):
+        self.assertEqual('0.500000s', format_result('chain/10/register', 0.5))
+        self.assertEqual('2048 bytes', format_result('chain/10/register_and_build_peak_memory',
+                                                     2048))
+
+class RunGraphTest(unittest.TestCase):
+    def test_runs_each_benchmark(self):
+        results = run_graph(graphs.random_dag(10), repeat=1)
+        self.assertIn('get_dependency_every_name', results)
+        self.assertIn('register_and_build', results)
+        self.assertGreater(results['register_and_build_peak_memory'], 0)
+
+    def test_stops_at_cycles(self):
+        results = run_graph(graphs.cyclic(10), repeat=1)
+        self.assertIn('register', results)
+        self.assertNotIn('build_injector', results)
+
+if __name__ == '__main__':
+    unittest.main()
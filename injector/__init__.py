@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
-from injector import exceptions, graph, dependencies, injector
+from injector import caching, exceptions, graph, dependencies, injector, proxy
 from injector.dependencies import Dependencies
 from injector.injector import Injector
+from injector.introspection import named
+from injector.proxy import lazy
@@ -0,0 +1,146 @@
+from __future__ import absolute_import
+import collections
+import threading
+import time
+
+from injector import exceptions
+
+SINGLETON = 'singleton'
+TRANSIENT = 'transient'
+
+# Returned by a store's get() when it doesn't have a value
+MISSING = object()
+
+class CachePolicy(object):
+    """ Base class for the ways an Injector can keep the values a factory returns.
+
+    A policy is only configuration: each Injector calls `create_store()` to get its
+    own storage for the policy, which is shared by all the names using the policy.
+    """
+
+    def create_store(self):
+        """ Creates the storage for the values of the factories using this policy.
+
+        :return: An object with get(name), put(name, value) and evict(name) methods,
+                 where get returns `MISSING` if there is no value.
+        """
+        raise NotImplementedError()
+
+class Transient(CachePolicy):
+    """ Never keeps values, so the factory is called every time the name is used. """
+
+    def create_store(self):
+        return _TransientStore()
+
+class TTL(CachePolicy):
+    """ Keeps values for a fixed time, after which the factory is called again. """
+
+    def __init__(self, seconds, clock=time.monotonic):
+        """
+        :param seconds: How long to keep each value
+        :param clock: (optional) A function returning the current time in seconds
+        """
+        self.seconds = seconds
+        self.clock = clock
+
+    def create_store(self):
+        return _TTLStore(self.seconds, self.clock)
+
+class LRU(CachePolicy):
+    """ Keeps a bounded number of values, evicting the least recently used first.
+
+    The bound applies to all the names registered with the same LRU instance, so
+    e.g. one LRU(10) shared by per-tenant factories keeps at most 10 tenants' values.
+    """
+
+    def __init__(self, maxsize):
+        """
+        :param maxsize: The most values to keep at once
+        """
+        self.maxsize = maxsize
+
+    def create_store(self):
+        return _LRUStore(self.maxsize)
+
+def to_policy(cache):
+    """ Converts the `cache` argument of `Dependencies.register_factory` to a policy.
+
+    :param cache: 'singleton', 'transient' or a CachePolicy
+    :return: A CachePolicy, or None for singletons (which the Injector keeps itself)
+    :raises CachePolicyException: if the argument isn't a known policy
+    """
+    if cache == SINGLETON:
+        return None
+    if cache == TRANSIENT:
+        return Transient()
+    if isinstance(cache, CachePolicy):
+        return cache
+    raise exceptions.CachePolicyException("Unknown cache policy: {!r}".format(cache))
+
+class _TransientStore(object):
+    # Every caller builds its own value, so they shouldn't wait on each other
+    single_flight = False
+
+    def get(self, name):
+        return MISSING
+
+    def put(self, name, value):
+        pass
+
+    def evict(self, name):
+        pass
+
+class _TTLStore(object):
+    single_flight = True
+
+    def __init__(self, seconds, clock):
+        self._seconds = seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def get(self, name):
+        entry = self._values.get(name)
+        if entry is None:
+            return MISSING
+        if entry[0] <= self._clock():
+            with self._lock:
+                if self._values.get(name) is entry:
+                    del self._values[name]
+            return MISSING
+        return entry[1]
+
+    def put(self, name, value):
+        with self._lock:
+            self._values[name] = (self._clock() + self._seconds, value)
+
+    def evict(self, name):
+        with self._lock:
+            self._values.pop(name, None)
+
+class _LRUStore(object):
+    single_flight = True
+
+    def __init__(self, maxsize):
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._values = collections.OrderedDict()
+
+    def get(self, name):
+        with self._lock:
+            try:
+                self._values.move_to_end(name)
+            except KeyError:
+                return MISSING
+            return self._values[name]
+
+    def put(self, name, value):
+        with self._lock:
+            self._values[name] = value
+            self._values.move_to_end(name)
+            while len(self._values) > self._maxsize:
+                self._values.popitem(last=False)
+
+    def evict(self, name):
+        with self._lock:
+            self._values.pop(name, None)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#pylint: disable=C0103
+
+from __future__ import absolute_import
+import unittest
+
+from injector import caching
+from injector.caching import LRU, MISSING, TTL, Transient
+from injector.exceptions import CachePolicyException
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class CachePolicyTest(unittest.TestCase):
+    def test_transient_keeps_nothing(self):
+        store = Transient().create_store()
+        store.put('x', 1)
+        self.assertIs(MISSING, store.get('x'))
+
+    def test_ttl_expires_values(self):
+        clock = FakeClock()
+        store = TTL(10, clock=clock).create_store()
+        store.put('x', 1)
+        clock.now = 9.9
+        self.assertEqual(1, store.get('x'))
+        clock.now = 10
+        self.assertIs(MISSING, store.get('x'))
+
+    def test_lru_evicts_least_recently_used(self):
+        store = LRU(2).create_store()
+        store.put('a', 1)
+        store.put('b', 2)
+        store.get('a')
+        store.put('c', 3)
+        self.assertEqual(1, store.get('a'))
+        self.assertIs(MISSING, store.get('b'))
+        self.assertEqual(3, store.get('c'))
+
+    def test_evict(self):
+        for policy in [TTL(10), LRU(2)]:
+            store = policy.create_store()
+            store.put('a', 1)
+            store.evict('a')
+            store.evict('b')
+            self.assertIs(MISSING, store.get('a'))
+
+    def test_to_policy(self):
+        self.assertIsNone(caching.to_policy('singleton'))
+        self.assertIsInstance(caching.to_policy('transient'), Transient)
+        policy = LRU(1)
+        self.assertIs(policy, caching.to_policy(policy))
+        with self.assertRaises(CachePolicyException):
+            caching.to_policy('forever')
+
+if __name__ == '__main__':
+    unittest.main()
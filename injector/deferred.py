@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+import importlib
+import inspect
+
+from injector import exceptions
+
+class DeferredFactory(object):
+    """ A factory named by a 'package.module:callable' path, which imports the module
+    the first time it is called (or `resolve()`d), so that registering the factory
+    doesn't import it.
+
+    `Dependencies.register_factory` wraps paths given as the factory in one of these.
+    """
+
+    __slots__ = ('path', '_module', '_attributes', '_function')
+
+    def __init__(self, path):
+        """
+        :param path: A string like 'package.module:callable' (the callable may be an
+                     attribute of something in the module, e.g. 'module:Class.create')
+        :raises BadNameException: if the path isn't of that form
+        """
+        module, _, attributes = path.partition(':')
+        self._attributes = attributes.split('.')
+        if not all(part.isidentifier() for part in module.split('.') + self._attributes):
+            raise exceptions.BadNameException(
+                "Bad factory path (expected 'package.module:callable'): {!r}".format(path))
+        self.path = path
+        self._module = module
+        self._function = None
+
+    def resolve(self):
+        """ Imports the callable, the first time this is called.
+
+        :return: The callable
+        :raises ImportFactoryException: if it can't be imported, or is a generator
+                                        function (which the injector must know about
+                                        when the factory is registered)
+        """
+        function = self._function
+        if function is None:
+            try:
+                function = importlib.import_module(self._module)
+                for attribute in self._attributes:
+                    function = getattr(function, attribute)
+            except (ImportError, AttributeError) as error:
+                raise exceptions.ImportFactoryException(
+                    "Can't import factory {}: {}".format(self.path, error))
+            if inspect.isgeneratorfunction(function) or inspect.isasyncgenfunction(function):
+                raise exceptions.ImportFactoryException(
+                    "Generator factory must be registered directly: {}".format(self.path))
+            self._function = function
+        return function
+
+    def is_resolved(self):
+        """ :return: True if the callable has been imported """
+        return self._function is not None
+
+    def __call__(self, *args):
+        return (self._function or self.resolve())(*args)
+
+    def __reduce__(self):
+        # Sent to other processes as the path, to be imported there
+        return (DeferredFactory, (self.path,))
+
+    def __repr__(self):
+        return 'DeferredFactory({!r})'.format(self.path)
+
+def preimport(factories):
+    """ Imports the deferred factories among some factory functions, skipping any that
+    fail (they raise again when the injector calls them).
+
+    :param factories: An iterable of factory functions
+    """
+    for factory in factories:
+        if isinstance(factory, DeferredFactory):
+            try:
+                factory.resolve()
+            except exceptions.ImportFactoryException:
+                pass
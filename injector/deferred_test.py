@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#pylint: disable=C0103
+
+from __future__ import absolute_import
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from injector.deferred import DeferredFactory
+from injector.dependencies import Dependencies
+from injector.exceptions import BadNameException
+from injector.exceptions import ImportFactoryException
+
+class DeferredFactoryTest(unittest.TestCase):
+    def setUp(self):
+        # Modules written for each test, so that none of them has been imported yet
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        sys.path.insert(0, self.directory)
+        self.addCleanup(sys.path.remove, self.directory)
+        self.prefix = 'deferred_{}_'.format(self._testMethodName)
+        self._write('db', '''
+            from injector.introspection import named
+
+            class Database(object):
+                def __init__(self, host):
+                    self.host = host
+
+                @classmethod
+                def create(cls, host: named('db-host')):
+                    return cls(host)
+
+            def connect(host: named('db-host')):
+                return Database(host)
+
+            def session(host):
+                yield host
+        ''')
+        self._write('mailer', '''
+            def make_mailer():
+                return 'mailer'
+        ''')
+        self.deps = Dependencies()
+        self.deps.register_value('db-host', 'localhost')
+
+    def _write(self, name, source):
+        with open(os.path.join(self.directory, self.prefix + name + '.py'), 'w') as output:
+            output.write(textwrap.dedent(source))
+        self.addCleanup(sys.modules.pop, self.prefix + name, None)
+
+    def _imported(self, name):
+        return self.prefix + name in sys.modules
+
+    def _path(self, name, function):
+        return '{}{}:{}'.format(self.prefix, name, function)
+
+    def test_imports_on_first_use(self):
+        self.deps.register_factory('db', self._path('db', 'connect'), dependencies=['db-host'])
+        injector = self.deps.build_injector()
+        self.assertFalse(self._imported('db'))
+        self.assertEqual('localhost', injector.get_dependency('db').host)
+        self.assertTrue(self._imported('db'))
+
+    def test_caches_the_callable(self):
+        factory = DeferredFactory(self._path('db', 'Database.create'))
+        self.assertFalse(factory.is_resolved())
+        self.assertIs(factory.resolve(), factory.resolve())
+        self.assertTrue(factory.is_resolved())
+        self.assertEqual('localhost', factory('localhost').host)
+
+    def test_infers_dependencies_by_importing(self):
+        self.deps.register_factory('db', self._path('db', 'connect'))
+        self.assertTrue(self._imported('db'))
+        self.assertEqual('localhost', self.deps.build_injector().get_dependency('db').host)
+
+    def test_rejects_bad_path(self):
+        for path in ['', 'module', 'module:', ':function', 'package..module:function',
+                     'module:function()']:
+            with self.assertRaises(BadNameException):
+                self.deps.register_factory('db', path, dependencies=[])
+
+    def test_reports_import_errors_when_used(self):
+        self.deps.register_factory('db', self._path('nothing', 'connect'), dependencies=[])
+        self.deps.register_factory('mailer', self._path('mailer', 'nothing'),
+                                   dependencies=[])
+        injector = self.deps.build_injector()
+        with self.assertRaises(ImportFactoryException):
+            injector.get_dependency('db')
+        with self.assertRaises(ImportFactoryException):
+            injector.get_dependency('mailer')
+
+    def test_rejects_generator_functions(self):
+        with self.assertRaises(ImportFactoryException):
+            self.deps.register_factory('session', self._path('db', 'session'))
+
+    def test_pickles_as_path(self):
+        factory = DeferredFactory(self._path('mailer', 'make_mailer'))
+        copy = pickle.loads(pickle.dumps(factory))
+        self.assertFalse(copy.is_resolved())
+        self.assertEqual('mailer', copy())
+
+    def test_preimport(self):
+        self.deps.register_factory('db', self._path('db', 'connect'), dependencies=['db-host'])
+        self.deps.register_factory('repository', lambda db: db, dependencies=['db'])
+        self.deps.register_factory('mailer', self._path('mailer', 'make_mailer'),
+                                   dependencies=[])
+        injector = self.deps.build_injector()
+        self.assertIsNone(injector.preimport(['repository'], background=False))
+        self.assertTrue(self._imported('db'))
+        self.assertFalse(self._imported('mailer'))
+
+        injector.preimport().join()
+        self.assertTrue(self._imported('mailer'))
+
+    def test_preimport_skips_import_errors(self):
+        self.deps.register_factory('db', self._path('nothing', 'connect'), dependencies=[])
+        injector = self.deps.build_injector()
+        injector.preimport(background=False)
+        with self.assertRaises(ImportFactoryException):
+            injector.get_dependency('db')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,60 @@
 from __future__ import absolute_import
-from injector import exceptions, graph, injector
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+
+from injector import caching, deferred, exceptions, graph, injector, introspection, pooling
+from injector.proxy import Lazy
+
+_CO_GENERATOR = inspect.CO_GENERATOR
+
+def _is_generator_function(factory):
+    # Much quicker than inspect.isgeneratorfunction() for plain functions and methods,
+    # which most factories are
+    try:
+        return factory.__code__.co_flags & _CO_GENERATOR != 0
+    except AttributeError:
+        return inspect.isgeneratorfunction(factory)
+
+def _dependency_list(spec):
+    return spec[1] or ()
+
+def _add_dependents(index, name, dependencies):
+    for dependency in dependencies:
+        dependents = index.get(dependency)
+        if dependents is None:
+            index[dependency] = [name]
+        else:
+            dependents.append(name)
 
 class Dependencies(object):
     """ A factory for setting up and building an Injector instance.  """
 
     def __init__(self):
         self._factories = dict()
+        # The graph of the factories isn't kept, only what is needed to check just the
+        # part of it that changed: how many of the factories (in the order they were
+        # registered) had been registered when it was last checked, and the names
+        # before that point that have to be checked again
+        self._checked = 0
+        self._rechecks = set()
+        # Maps a name to the set of its dependencies that weren't registered when it
+        # was last checked
+        self._missing = {}
+        # Maps a name to the names that depend on it, built the first time only part of
+        # the graph is checked (factories that are only checked once don't need it)
+        self._dependents = None
+        # The DependencyGraph made by dependency_graph(), until the next registration
+        self._dependency_graph = None
+        self._content_hash = None
+        # The names registered with some options, kept as they are registered so that
+        # checking the graph and building injectors don't have to look at every factory
+        self._request_names = set()
+        self._expiring_names = set()
+        self._pool_names = set()
+        self._fork_unsafe_names = set()
 
     def register_value(self, name, value):
         """
@@ -14,20 +63,242 @@ class Dependencies(object):
         :param name: A string naming the dependency (e.g. 'db-host-name')
         :param value: Any value (e.g. 'master.postgres.internal')
         """
-        self.register_factory(name, lambda: value)
+        self.register_factory(name, lambda: value, dependencies=[])
 
-    def register_factory(self, name, factory, dependencies=None):
+    def register_factory(self, name, factory, dependencies=None, scope=injector.SINGLETON,
+                         cache=caching.SINGLETON, fork_safe=True, finalizer=None,
+                         shared=False):
         """ Binds a factory to a name. The injector will call the factory function once
         (if the name is ever used), and always return the value that the factory returns.
 
         The factory will be called with the dependencies (if any listed) as arguments.
+        If the factory is a generator function, the value is the first thing it yields,
+        and it is resumed when the injector is closed, to tear the value down.
+
+        The factory can also be given as a string like 'package.module:callable', so
+        that its module is only imported when the value is first built (or by
+        `Injector.preimport()`). The dependencies must then be listed, or the module is
+        imported right away to read the signature, and generator functions can't be
+        used this way.
+
+        :param name: A string naming the dependency (e.g. 'db-connection')
+        :param factory: A factory function to create the dependency, or its import path
+        :param dependencies: (optional) A list of dependencies of the factory function
+                             (names wrapped with `lazy()` are injected as proxies that
+                             build the value on first use). If not given, they are
+                             taken from the factory's signature (see
+                             `introspection.infer_dependencies`).
+        :param scope: (optional) 'singleton' (the default) to share one value, or
+                      'request' to build the value once per child injector (see
+                      `Injector.child()`).
+        :param cache: (optional) How long to keep the value: 'singleton' (the default)
+                      keeps it forever, 'transient' calls the factory every time, and
+                      `caching.TTL(seconds)` or `caching.LRU(maxsize)` keep it for a
+                      while. Singletons can't depend on such a value directly, since
+                      they would keep the first one forever; they can depend on
+                      `lazy(name)` to get the current value each time it is used.
+        :param fork_safe: (optional) False if the value can't be used after the process
+                          forks (e.g. it holds a socket), so forked children rebuild it
+                          and everything depending on it (see `Injector.after_fork()`).
+        :param finalizer: (optional) A function to call with the value when the injector
+                          is closed (see `Injector.close()`).
+        :param shared: (optional) True if the value must be the same for every tenant
+                       (see `build_injectors()`), so that it is an error for it to
+                       depend on a tenant's overrides.
+        """
+        self._check_name(name)
+        factory = self._factory_function(factory)
+        if dependencies is None:
+            dependencies = self._infer_dependencies(factory)
+        # Only the options that aren't the defaults are kept, since most factories use
+        # the defaults and can then all share one empty dict
+        options = {}
+        if scope != injector.SINGLETON:
+            if scope != injector.REQUEST:
+                raise exceptions.ScopeException("Unknown scope: {!r}".format(scope))
+            options['scope'] = scope
+        if cache != caching.SINGLETON:
+            cache = caching.to_policy(cache)
+            if cache is not None:
+                options['cache'] = cache
+        if not fork_safe:
+            options['fork_safe'] = False
+        if _is_generator_function(factory):
+            options['generator'] = True
+        if finalizer is not None:
+            options['finalizer'] = finalizer
+        if shared:
+            options['shared'] = True
+        options = options or injector._NO_OPTIONS #pylint: disable=W0212
+        self._add(name, (factory, dependencies, options))
+
+    def register_async_factory(self, name, factory, dependencies=None, finalizer=None):
+        """ Binds an async factory to a name. This works like `register_factory`, except
+        that the factory returns an awaitable (e.g. it is an `async def` function), so the
+        dependency has to be fetched with `Injector.aget_dependency`.
+
+        The factory can also be an async generator function, in which case the value
+        is the first thing it yields, and it is resumed by `Injector.aclose()`.
+
+        :param name: A string naming the dependency (e.g. 'db-connection')
+        :param factory: A coroutine function to create the dependency, or its import
+                        path (see `register_factory`)
+        :param dependencies: (optional) A list of dependencies of the factory function
+                             (taken from its signature if not given)
+        :param finalizer: (optional) A function (or coroutine function) to call with the
+                          value when the injector is closed.
+        """
+        self._check_name(name)
+        factory = self._factory_function(factory)
+        if dependencies is None:
+            dependencies = self._infer_dependencies(factory)
+        options = {'async': True}
+        if inspect.isasyncgenfunction(factory):
+            options['generator'] = True
+        if finalizer is not None:
+            options['finalizer'] = finalizer
+        self._add(name, (factory, dependencies, options))
+
+    def dependency_graph(self):
+        """ Gets the graph of the registered factories, for asking questions like what
+        a factory depends on (see `graph.DependencyGraph`). It is made when first asked
+        for, and answers are kept until the next factory is registered, after which
+        this makes a new graph (so ask for it again rather than keeping it).
+
+        :return: A DependencyGraph
+        """
+        if self._dependency_graph is None:
+            self._dependency_graph = graph.DependencyGraph({
+                name: spec[1] or [] for name, spec in self._factories.items()
+            })
+        return self._dependency_graph
+
+    def content_hash(self):
+        """ Gets a digest of everything that `build_injector()` checks: the names, their
+        dependencies, their scopes and whether their values expire (have a cache
+        policy). It doesn't depend on the factory functions, the cache policies'
+        settings, or the order the names were registered in.
+
+        :return: A hex string
+        """
+        if self._content_hash is None:
+            # One flat list, rather than a list per name, so that building it doesn't
+            # set off the garbage collector on large graphs
+            content = []
+            for name in sorted(self._factories):
+                _, dependencies, options = self._factories[name]
+                dependencies = dependencies or ()
+                lazy = [i for i, d in enumerate(dependencies) if isinstance(d, Lazy)]
+                scope = options.get('scope', injector.SINGLETON)
+                expiring = options.get('cache') is not None
+                content.extend((name, scope, expiring, len(dependencies), len(lazy)))
+                content.extend(dependencies)
+                content.extend(lazy)
+            self._content_hash = hashlib.sha256(
+                json.dumps(content, separators=(',', ':')).encode('utf-8')).hexdigest()
+        return self._content_hash
+
+    def freeze(self):
+        """ Checks the registered factories, and makes an immutable snapshot of their
+        graph (see `graph.FrozenGraph`), keyed by `content_hash()`.
+
+        A snapshot saved to a file (e.g. at build time, or by the first of several
+        worker processes) can be loaded and passed to `build_injector()`, which then
+        skips the checks if the factories haven't changed since.
+
+        :return: A FrozenGraph
+        :raises MissingDependencyException: if a dependency isn't registered
+        :raises CircularDependencyException: if the graph contains a cycle
+        """
+        self._check_injector_state()
+        return graph.FrozenGraph.from_compact(self.content_hash(), self._compact())
+
+    def register_pool(self, name, factory, dependencies=None, size=10, max_idle=None,
+                      timeout=None, finalizer=None, fork_safe=False):
+        """ Binds a pool of instances to a name, for things that can only be used by one
+        caller at a time (e.g. database connections or parsers).
+
+        The value of the name is a `pooling.Pool`, which builds instances with the
+        factory when they are needed, up to `size` of them. `Injector.checkout()` takes
+        an instance for a `with` block, and `Injector.inject()` checks one out for each
+        pool the function depends on, for the length of the call. Factories that
+        depend on the name get the pool itself.
 
         :param name: A string naming the dependency (e.g. 'db-connection')
-        :param factory: A factory function to create the dependency
+        :param factory: A factory function to create each instance, or its import path
+                        (see `register_factory`)
         :param dependencies: (optional) A list of dependencies of the factory function
+                             (taken from its signature if not given)
+        :param size: (optional) The most instances to have at once
+        :param max_idle: (optional) Seconds an instance can go unused before it is
+                         dropped
+        :param timeout: (optional) Seconds to wait for an instance when they are all in
+                        use, before raising `PoolException` (by default, wait forever)
+        :param finalizer: (optional) A function to call with each instance that is
+                          dropped (including when the injector is closed)
+        :param fork_safe: (optional) Pools are rebuilt in forked child processes unless
+                          this is True (see `register_factory`)
         """
         self._check_name(name)
-        self._factories[name] = (factory, dependencies)
+        factory = self._factory_function(factory)
+        if dependencies is None:
+            dependencies = self._infer_dependencies(factory)
+        if size < 1:
+            raise exceptions.PoolException("Pool size must be at least 1: {!r}".format(size))
+
+        def create_pool(*args):
+            return pooling.Pool(functools.partial(factory, *args), size, max_idle=max_idle,
+                                timeout=timeout, finalizer=finalizer)
+
+        options = {'finalizer': pooling.Pool.close, 'pool': True}
+        if not fork_safe:
+            options['fork_safe'] = False
+        self._add(name, (create_pool, dependencies, options))
+
+    @staticmethod
+    def _factory_function(factory):
+        if isinstance(factory, str):
+            return deferred.DeferredFactory(factory)
+        return factory
+
+    @staticmethod
+    def _infer_dependencies(factory):
+        if isinstance(factory, deferred.DeferredFactory):
+            factory = factory.resolve()
+        return introspection.infer_dependencies(factory)
+
+    def _add(self, name, spec):
+        self._factories[name] = spec
+        if self._dependents is not None:
+            _add_dependents(self._dependents, name, spec[1] or ())
+        self._dependency_graph = None
+        self._content_hash = None
+        options = spec[2]
+        if options:
+            if options.get('scope') == injector.REQUEST:
+                self._request_names.add(name)
+            if options.get('cache') is not None:
+                self._expiring_names.add(name)
+            if options.get('pool'):
+                self._pool_names.add(name)
+            if options.get('fork_safe') is False:
+                self._fork_unsafe_names.add(name)
+
+    def _build(self, factories, **kwargs):
+        """ Makes an injector of some of the factories, passing it the names with
+        options so that it doesn't look for them.
+        """
+        return injector.Injector(
+            factories,
+            request_names=frozenset(n for n in self._request_names if n in factories),
+            pool_names=frozenset(n for n in self._pool_names if n in factories),
+            fork_unsafe_names=frozenset(n for n in self._fork_unsafe_names if n in factories),
+            **kwargs
+        )
+
+    def _compact(self):
+        """ :return: A CompactGraph of all the factories """
+        return graph.CompactGraph(self._factories, key=_dependency_list)
 
     def _check_name(self, name):
         if not name or not isinstance(name, str):
@@ -35,25 +306,239 @@ class Dependencies(object):
         if name in self._factories:
             raise exceptions.DuplicateNameException("Duplicate name: {}".format(name))
 
-    def _make_dependency_graph(self):
-        return graph.DependencyGraph({
-            name: dependencies or []
-            for name, (_, dependencies) in self._factories.items()
-        })
+    @classmethod
+    def merge(cls, *modules):
+        """ Combines several Dependencies (e.g. one per library or plugin) into one.
+
+        Each module is checked on its own first, which is only done once for each
+        module (until more factories are registered in it). After that, only the
+        names and the dependencies between modules have to be checked.
+
+        :param modules: Dependencies objects with no names in common
+        :return: A new Dependencies, with the factories of all the modules
+        :raises CircularDependencyException: if a module has a cycle of its own
+        """
+        merged = cls()
+        for module in modules:
+            module._check_module() #pylint: disable=W0212
+            for name in module._factories: #pylint: disable=W0212
+                if name in merged._factories: #pylint: disable=W0212
+                    raise exceptions.DuplicateNameException("Duplicate name: {}".format(name))
+            merged._factories.update(module._factories) #pylint: disable=W0212
+            merged._request_names.update(module._request_names) #pylint: disable=W0212
+            merged._expiring_names.update(module._expiring_names) #pylint: disable=W0212
+            merged._pool_names.update(module._pool_names) #pylint: disable=W0212
+            merged._fork_unsafe_names.update(module._fork_unsafe_names) #pylint: disable=W0212
+            # The names that depend on other modules are checked again. A new cycle
+            # would have to pass through one of them, so the rest aren't.
+            merged._rechecks.update(module._missing) #pylint: disable=W0212
+        merged._checked = len(merged._factories) #pylint: disable=W0212
+        return merged
+
+    def _check_module(self):
+        # Dependencies on other modules can't be checked until they are merged
+        self._check_graph(allow_missing=True)
 
     def _check_injector_state(self):
-        dependency_graph = self._make_dependency_graph()
-        if dependency_graph.has_missing_dependencies():
-            raise exceptions.MissingDependencyException()
-        if dependency_graph.has_circular_dependencies():
-            raise exceptions.CircularDependencyException()
+        self._check_graph()
+
+    def _unchecked_names(self):
+        """ Lists the names registered since the graph was last checked, and the names
+        checked before whose missing dependencies have since been registered (a new
+        cycle or scope error could go through them).
 
-    def build_injector(self):
+        :return: A list of names
+        """
+        factories = self._factories
+        for name, missing in list(self._missing.items()):
+            found = [dependency for dependency in missing if dependency in factories]
+            if found:
+                missing.difference_update(found)
+                if not missing:
+                    del self._missing[name]
+                self._rechecks.add(name)
+        names = list(itertools.islice(factories, self._checked, None))
+        if self._rechecks:
+            new_names = set(names)
+            names.extend(name for name in self._rechecks if name not in new_names)
+        return names
+
+    def _check_graph(self, allow_missing=False):
+        """ Checks the names that changed since the last successful check (see
+        `_unchecked_names()`).
+
+        Only the part of the graph that can reach one of those names is searched for
+        cycles, since any new cycle has to pass through one of them.
+        """
+        factories = self._factories
+        names = self._unchecked_names()
+        self._check_scopes(names)
+        for name in names:
+            missing = [d for d in factories[name][1] or () if d not in factories]
+            if missing:
+                self._missing[name] = set(missing)
+        if len(names) == len(factories):
+            compact = self._compact()
+        else:
+            compact = graph.CompactGraph(
+                {name: factories[name][1] or () for name in self._reaching(names)})
+        cycles = [[compact.names[i] for i in cycle] for cycle in compact.cycles()]
+        # Missing dependencies are always reported (and registering one marks the names
+        # that need it), so the names only have to be checked again for cycles
+        if not cycles:
+            self._mark_checked()
+        missing = {} if allow_missing else {
+            name: sorted(dependencies) for name, dependencies in self._missing.items()
+        }
+        self._raise_problems(missing, cycles)
+
+    def _mark_checked(self):
+        self._checked = len(self._factories)
+        self._rechecks.clear()
+
+    def _reaching(self, names):
+        """ Finds the names that (transitively) depend on any of the given ones,
+        including themselves.
+
+        :return: A set of names
+        """
+        if self._dependents is None:
+            self._dependents = {}
+            for name, spec in self._factories.items():
+                _add_dependents(self._dependents, name, spec[1] or ())
+        region = set(names)
+        frontier = list(region)
+        while frontier:
+            for dependent in self._dependents.get(frontier.pop(), ()):
+                if dependent not in region:
+                    region.add(dependent)
+                    frontier.append(dependent)
+        return region
+
+    @staticmethod
+    def _raise_problems(missing, cycles):
+        """ Raises an exception for the first kind of problem found by a check.
+
+        :param missing: A dict of {name: [missing dependency]}
+        :param cycles: A list of cycles, each a list of names
+        """
+        if missing:
+            raise exceptions.MissingDependencyException("Missing dependencies: {}".format(
+                "; ".join(
+                    "{} needs {}".format(name, ", ".join(dependencies))
+                    for name, dependencies in sorted(missing.items())
+                )
+            ))
+        if cycles:
+            raise exceptions.CircularDependencyException("Circular dependencies: {}".format(
+                "; ".join(" -> ".join(cycle) for cycle in cycles)
+            ))
+
+    def _check_scopes(self, names):
+        request_names = self._request_names
+        expiring_names = self._expiring_names
+        if not request_names and not expiring_names:
+            return
+        for name in names:
+            if name in request_names:
+                continue
+            kept_forever = name not in expiring_names
+            for dependency in self._factories[name][1] or ():
+                if dependency in request_names:
+                    raise exceptions.ScopeException(
+                        "Singleton {} depends on request-scoped {}".format(name, dependency))
+                if kept_forever and dependency in expiring_names and \
+                        not isinstance(dependency, Lazy):
+                    raise exceptions.ScopeException(
+                        "Singleton {} would keep the first value of {}, which isn't "
+                        "kept forever (depend on lazy({!r}) instead)".format(
+                            name, dependency, str(dependency)))
+
+    def build_injector(self, roots=None, modules=None, snapshot=None):
         """ Builds an injector instance that can be used to inject dependencies.
 
-        Also checks for common errors (missing dependencies and circular dependencies).
+        Also checks for common errors (missing dependencies and circular dependencies),
+        unless a snapshot of the same factories is given.
 
+        :param roots: (optional) A list of the names the injector will be used for.
+                      When given, only these and what they (transitively) depend on
+                      are checked and put in the injector.
+        :param modules: (optional) A list of other Dependencies to include, as if
+                        combined with `merge()`.
+        :param snapshot: (optional) A FrozenGraph from `freeze()` (e.g. loaded with
+                         `graph.FrozenGraph.load()`). If its digest matches
+                         `content_hash()`, the factories were already checked when it
+                         was made; otherwise it is ignored.
         :return: Injector
         """
+        if modules:
+            return Dependencies.merge(self, *modules).build_injector(roots, snapshot=snapshot)
+        checked = snapshot is not None and snapshot.digest() == self.content_hash()
+        if checked:
+            self._mark_checked()
+            self._missing.clear()
+        if roots is None:
+            if not checked:
+                self._check_injector_state()
+            return self._build(self._factories)
+
+        for name in roots:
+            if name not in self._factories:
+                raise exceptions.MissingDependencyException(
+                    "Missing dependency name: {}".format(name))
+        reachable = {}
+        frontier = list(roots)
+        while frontier:
+            name = str(frontier.pop())
+            if name not in reachable and name in self._factories:
+                dependencies = reachable[name] = self._factories[name][1] or []
+                frontier.extend(dependencies)
+        if not checked:
+            self._check_scopes(reachable)
+            self._raise_problems(*graph.DependencyGraph(reachable).validate())
+        return self._build({name: self._factories[name] for name in reachable})
+
+    def build_injectors(self, tenant_overrides):
+        """ Builds an injector for each tenant, sharing the values that are the same for
+        every tenant.
+
+        A value is specific to the tenants if one of them overrides its name, or if it
+        (transitively) depends on such a name. Those values are built by each tenant's
+        injector, and everything else is built once, by a shared injector that the
+        tenants' injectors are children of. So the memory and time taken for each
+        tenant only grow with the tenant-specific part of the graph.
+
+        :param tenant_overrides: A dict of {tenant: {name: value}}
+        :return: A tuple (shared injector, {tenant: injector}). Closing a tenant's
+                 injector only tears down its own values, so close the shared one last.
+        :raises ScopeException: if a factory registered with shared=True is specific to
+                                the tenants.
+        """
         self._check_injector_state()
-        return injector.Injector(self._factories)
+        overridden = set()
+        for overrides in tenant_overrides.values():
+            overridden.update(overrides)
+        for name in overridden:
+            if name not in self._factories:
+                raise exceptions.MissingDependencyException(
+                    "Missing dependency name: {}".format(name))
+        compact = self._compact()
+        tenant_names = set(overridden)
+        for name in overridden:
+            tenant_names.update(
+                compact.names[i] for i in compact.closure(compact.index[name], reverse=True))
+        for name in sorted(tenant_names):
+            if injector.is_shared(self._factories[name]):
+                depends_on = {compact.names[i] for i in compact.closure(compact.index[name])}
+                depends_on.add(name)
+                raise exceptions.ScopeException(
+                    "Shared {} depends on tenant-specific {}".format(
+                        name, ", ".join(sorted(overridden & depends_on))))
+
+        shared = self._build(self._factories)
+        tenant_names = frozenset(tenant_names)
+        return shared, {
+            tenant: injector.Injector(self._factories, parent=shared, overrides=overrides,
+                                      local_names=tenant_names)
+            for tenant, overrides in tenant_overrides.items()
+        }
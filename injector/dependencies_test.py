@@ -2,13 +2,23 @@
 #pylint: disable=C0103
 
 from __future__ import absolute_import
+import asyncio
+import os
 import unittest
+from unittest import mock
 
+from injector.caching import TTL
 from injector.dependencies import Dependencies
 from injector.exceptions import BadNameException
+from injector.exceptions import CachePolicyException
 from injector.exceptions import CircularDependencyException
 from injector.exceptions import DuplicateNameException
 from injector.exceptions import MissingDependencyException
+from injector.exceptions import PoolException
+from injector.exceptions import ScopeException
+from injector.graph import DependencyGraph
+from injector.introspection import named
+from injector.proxy import lazy
 
 class DependenciesTest(unittest.TestCase):
     def setUp(self):
@@ -23,6 +33,15 @@ class DependenciesTest(unittest.TestCase):
             'my factory', lambda: 1, dependencies=['my value']
         )
 
+    def test_only_keeps_options_that_are_not_defaults(self):
+        self.dependencies.register_value('a', 1)
+        self.dependencies.register_factory('b', lambda a: a, scope='singleton', fork_safe=True)
+        self.dependencies.register_factory('c', lambda a: a, fork_safe=False)
+        factories = self.dependencies._factories
+        self.assertEqual({}, factories['a'][2])
+        self.assertIs(factories['a'][2], factories['b'][2])
+        self.assertEqual({'fork_safe': False}, factories['c'][2])
+
     def test_requires_names(self):
         with self.assertRaises(BadNameException):
             self.dependencies.register_value(None, 123)
@@ -56,5 +75,426 @@ class DependenciesTest(unittest.TestCase):
         with self.assertRaises(CircularDependencyException):
             self.dependencies.build_injector()
 
+    def test_reports_names_of_missing_dependencies(self):
+        self.dependencies.register_factory('f1', lambda f2: 1, dependencies=['f2'])
+        self.dependencies.register_factory('f3', lambda f4: 1, dependencies=['f4'])
+
+        with self.assertRaisesRegex(MissingDependencyException, 'f1 needs f2; f3 needs f4'):
+            self.dependencies.build_injector()
+
+    def test_reports_circular_dependency_path(self):
+        self.dependencies.register_factory('f1', lambda f2: 1, dependencies=['f2'])
+        self.dependencies.register_factory('f2', lambda f1: 2, dependencies=['f1'])
+
+        with self.assertRaisesRegex(CircularDependencyException, 'f1 -> f2 -> f1|f2 -> f1 -> f2'):
+            self.dependencies.build_injector()
+
+    def test_builds_injector_after_registering_more(self):
+        self.dependencies.register_factory('f1', lambda f2: f2, dependencies=['f2'])
+        with self.assertRaises(MissingDependencyException):
+            self.dependencies.build_injector()
+
+        self.dependencies.register_value('f2', 2)
+        self.assertEqual(self.dependencies.build_injector().get_dependency('f1'), 2)
+
+    def test_only_checks_what_changed(self):
+        self.dependencies.register_factory('f1', lambda f2: f2, dependencies=['f2'])
+        self.dependencies.register_factory('f2', lambda f3: f3, dependencies=['f3'])
+        with self.assertRaises(MissingDependencyException):
+            self.dependencies.build_injector()
+        self.assertEqual([], self.dependencies._unchecked_names())
+
+        self.dependencies.register_factory('f4', lambda: 4, dependencies=[])
+        self.assertEqual(['f4'], self.dependencies._unchecked_names())
+        # f2 is checked again once the name it was missing is registered
+        self.dependencies.register_factory('f3', lambda f1: f1, dependencies=['f1'])
+        self.assertEqual({'f2', 'f3', 'f4'}, set(self.dependencies._unchecked_names()))
+        with self.assertRaises(CircularDependencyException):
+            self.dependencies.build_injector()
+
+    def test_infers_dependencies_from_signature(self):
+        def greeting(name, punctuation: named('mark'), suffix=''):
+            return 'hello ' + name + punctuation + suffix
+        self.dependencies.register_factory('greeting', greeting)
+        self.dependencies.register_value('name', 'world')
+        self.dependencies.register_value('mark', '!')
+        inj = self.dependencies.build_injector()
+
+        self.assertEqual(inj.get_dependency('greeting'), 'hello world!')
+        self.assertEqual(inj.inject(lambda greeting, name: greeting + name), 'hello world!world')
+
+    def test_builds_injector_for_roots(self):
+        self.dependencies.register_value('x', 1)
+        self.dependencies.register_factory('y', lambda x: x + 1, dependencies=['x'])
+        self.dependencies.register_factory('unused', lambda z: z, dependencies=['missing'])
+        inj = self.dependencies.build_injector(roots=['y'])
+
+        self.assertEqual(inj.get_dependency('y'), 2)
+        self.assertTrue(inj.has_dependency('x'))
+        self.assertFalse(inj.has_dependency('unused'))
+
+    def test_checks_dependencies_of_roots(self):
+        self.dependencies.register_factory('f1', lambda f2: 1, dependencies=['f2'])
+        self.dependencies.register_factory('f2', lambda f1: 2, dependencies=['f1'])
+        self.dependencies.register_factory('f3', lambda f4: 3, dependencies=['f4'])
+
+        with self.assertRaises(CircularDependencyException):
+            self.dependencies.build_injector(roots=['f1'])
+        with self.assertRaises(MissingDependencyException):
+            self.dependencies.build_injector(roots=['f3'])
+        with self.assertRaises(MissingDependencyException):
+            self.dependencies.build_injector(roots=['f5'])
+
+    def test_builds_injector_with_request_scope(self):
+        self.dependencies.register_value('x', 1)
+        self.dependencies.register_factory(
+            'y', lambda x: [x], dependencies=['x'], scope='request'
+        )
+        inj = self.dependencies.build_injector()
+
+        self.assertEqual(inj.child().get_dependency('y'), [1])
+        self.assertIsNot(inj.child().get_dependency('y'), inj.child().get_dependency('y'))
+
+    def test_passes_names_with_options_to_injector(self):
+        self.dependencies.register_factory('user', lambda: 'u', scope='request')
+        self.dependencies.register_factory('socket', object, fork_safe=False)
+        self.dependencies.register_pool('parser', object, dependencies=[])
+        self.dependencies.register_factory('page', lambda u, p: u, dependencies=['user', 'parser'],
+                                           scope='request')
+        with mock.patch('injector.injector.is_request_scoped') as is_request_scoped:
+            inj = self.dependencies.build_injector()
+            roots_inj = self.dependencies.build_injector(roots=['parser'])
+        is_request_scoped.assert_not_called()
+        self.assertEqual(frozenset(['user', 'page']), inj._request_names)
+        self.assertEqual(frozenset(['parser']), inj._pool_names)
+        self.assertEqual(frozenset(['socket', 'parser']), inj._fork_unsafe_names)
+        self.assertEqual(frozenset(), roots_inj._request_names)
+        self.assertEqual(frozenset(['parser']), roots_inj._fork_unsafe_names)
+
+    def test_rejects_unknown_scope(self):
+        with self.assertRaises(ScopeException):
+            self.dependencies.register_factory('x', lambda: 1, scope='session')
+
+    def test_catches_singleton_depending_on_request_scope(self):
+        self.dependencies.register_factory('x', lambda: 1, scope='request')
+        self.dependencies.register_factory('y', lambda x: x, dependencies=['x'])
+
+        with self.assertRaises(ScopeException):
+            self.dependencies.build_injector()
+
+    def test_checks_scope_of_dependency_registered_later(self):
+        for options in [{'scope': 'request'}, {'cache': 'transient'}]:
+            dependencies = Dependencies()
+            dependencies.register_factory('s', lambda r: r, dependencies=['req'])
+            with self.assertRaises(MissingDependencyException):
+                dependencies.build_injector()
+            dependencies.register_factory('req', lambda: 1, **options)
+            with self.assertRaises(ScopeException):
+                dependencies.build_injector()
+
+    def test_builds_injector_with_cache_policies(self):
+        self.dependencies.register_factory('transient', object, cache='transient')
+        self.dependencies.register_factory('ttl', object, cache=TTL(60))
+        inj = self.dependencies.build_injector()
+
+        self.assertIsNot(inj.get_dependency('transient'), inj.get_dependency('transient'))
+        self.assertIs(inj.get_dependency('ttl'), inj.get_dependency('ttl'))
+
+    def test_catches_singleton_depending_on_expiring_value(self):
+        self.dependencies.register_factory('credentials', object, cache=TTL(60))
+        self.dependencies.register_factory('client', lambda c: c, dependencies=['credentials'])
+        with self.assertRaises(ScopeException):
+            self.dependencies.build_injector()
+
+    def test_singleton_can_depend_lazily_on_expiring_value(self):
+        tokens = iter(range(10))
+        self.dependencies.register_factory('credentials', lambda: {'token': next(tokens)},
+                                           cache='transient')
+        self.dependencies.register_factory('client', lambda c: c,
+                                           dependencies=[lazy('credentials')])
+        self.dependencies.register_factory('request', lambda c: c, cache='transient',
+                                           dependencies=['credentials'])
+        inj = self.dependencies.build_injector()
+        client = inj.get_dependency('client')
+        self.assertEqual([0, 1], [client['token'], client['token']])
+
+    def test_rejects_unknown_cache_policy(self):
+        with self.assertRaises(CachePolicyException):
+            self.dependencies.register_factory('x', object, cache='forever')
+
+    def test_builds_injector_with_fork_unsafe_factories(self):
+        self.dependencies.register_factory('socket', object, fork_safe=False)
+        self.dependencies.register_factory('client', lambda s: s, dependencies=['socket'])
+        inj = self.dependencies.build_injector()
+
+        self.assertEqual(inj.prepare_fork(), frozenset(['socket', 'client']))
+
+    def test_builds_injector_with_finalizers(self):
+        events = []
+        def resource():
+            yield 'resource'
+            events.append('closed resource')
+        self.dependencies.register_factory('resource', resource)
+        self.dependencies.register_factory(
+            'user', lambda r: 'user', dependencies=['resource'], finalizer=events.append
+        )
+        inj = self.dependencies.build_injector()
+
+        self.assertEqual(inj.get_dependency('user'), 'user')
+        inj.close()
+        self.assertEqual(events, ['user', 'closed resource'])
+
+    def test_builds_injector_with_async_factories(self):
+        async def double(x):
+            return x * 2
+        self.dependencies.register_value('x', 21)
+        self.dependencies.register_async_factory('y', double, dependencies=['x'])
+        inj = self.dependencies.build_injector()
+
+        self.assertEqual(asyncio.run(inj.aget_dependency('y')), 42)
+
+    def test_builds_injector_with_pools(self):
+        closed = []
+        self.dependencies.register_value('dsn', 'db://')
+        self.dependencies.register_pool('db', lambda dsn: [dsn], size=1, timeout=0,
+                                        finalizer=closed.append)
+        inj = self.dependencies.build_injector()
+
+        with inj.checkout('db') as connection:
+            self.assertEqual(['db://'], connection)
+            with self.assertRaises(PoolException):
+                with inj.checkout('db'):
+                    pass
+        self.assertEqual(['db://'], inj.inject(lambda db: db))
+        inj.close()
+        self.assertEqual([connection], closed)
+
+    def test_rejects_empty_pool(self):
+        with self.assertRaises(PoolException):
+            self.dependencies.register_pool('db', lambda: 1, size=0)
+
+    def test_answers_graph_queries(self):
+        self.dependencies.register_value('x', 1)
+        self.dependencies.register_factory('y', lambda x: x, dependencies=['x'])
+        dependency_graph = self.dependencies.dependency_graph()
+        self.assertEqual(dependency_graph.transitive_dependents('x'), frozenset(['y']))
+
+        self.assertIs(dependency_graph, self.dependencies.dependency_graph())
+
+        self.dependencies.register_factory('z', lambda y: y, dependencies=['y'])
+        dependency_graph = self.dependencies.dependency_graph()
+        self.assertEqual(dependency_graph.transitive_dependents('x'), frozenset(['y', 'z']))
+        self.assertEqual(dependency_graph.depth('z'), 2)
+
+class TenantTest(unittest.TestCase):
+    def setUp(self):
+        self.built = []
+        def build(name, value):
+            self.built.append(name)
+            return value
+        self.dependencies = Dependencies()
+        self.dependencies.register_value('tenant-name', None)
+        self.dependencies.register_factory('schema', lambda: build('schema', 'schema'),
+                                           shared=True)
+        self.dependencies.register_factory(
+            'greeting', lambda n, s: build('greeting', 'hi ' + n),
+            dependencies=['tenant-name', 'schema'])
+        self.dependencies.register_factory(
+            'handler', lambda g, s: build('handler', g), dependencies=['greeting', 'schema'])
+
+    def test_builds_shared_values_once(self):
+        shared, tenants = self.dependencies.build_injectors({
+            'a': {'tenant-name': 'a'},
+            'b': {'tenant-name': 'b'},
+        })
+        self.assertEqual(tenants['a'].get_dependency('handler'), 'hi a')
+        self.assertEqual(tenants['b'].get_dependency('handler'), 'hi b')
+        self.assertEqual(self.built.count('schema'), 1)
+        self.assertEqual(self.built.count('handler'), 2)
+        self.assertIn('schema', shared._value_cache)
+        self.assertNotIn('handler', shared._value_cache)
+
+    def test_tenant_children_share_tenant_values(self):
+        _, tenants = self.dependencies.build_injectors({'a': {'tenant-name': 'a'}})
+        self.assertEqual(tenants['a'].child().get_dependency('handler'), 'hi a')
+        self.assertEqual(tenants['a'].get_dependency('handler'), 'hi a')
+        self.assertEqual(self.built.count('handler'), 1)
+
+    def test_rejects_shared_value_depending_on_tenant(self):
+        self.dependencies.register_factory('cache', lambda g: g, dependencies=['greeting'],
+                                           shared=True)
+        with self.assertRaises(ScopeException):
+            self.dependencies.build_injectors({'a': {'tenant-name': 'a'}})
+
+    def test_rejects_unknown_overrides(self):
+        with self.assertRaises(MissingDependencyException):
+            self.dependencies.build_injectors({'a': {'nope': 1}})
+
+    def test_overridden_values_dependencies_are_not_built(self):
+        def loader():
+            raise ValueError('no config file')
+        self.dependencies.register_factory('loader', loader)
+        self.dependencies.register_factory('config', lambda l: l, dependencies=['loader'])
+        self.dependencies.register_factory('app', 'app with {}'.format,
+                                           dependencies=['config'])
+        _, tenants = self.dependencies.build_injectors({'a': {'config': 'A'}})
+        self.assertEqual(tenants['a'].get_dependency('app'), 'app with A')
+        self.assertEqual(tenants['a'].get_dependencies(['app', 'config']),
+                         ('app with A', 'A'))
+
+    def test_tenant_resets_values_depending_on_shared_fork_unsafe_value(self):
+        self.dependencies.register_factory('sock', object, fork_safe=False)
+        self.dependencies.register_factory('client', lambda n, s: (n, s),
+                                           dependencies=['tenant-name', 'sock'])
+        shared, tenants = self.dependencies.build_injectors({
+            'a': {'tenant-name': 'a'},
+            'b': {'tenant-name': 'b'},
+        })
+        client = tenants['a'].get_dependency('client')
+        self.assertEqual('a', client[0])
+
+        shared.after_fork()
+        tenants['a'].after_fork()
+
+        self.assertEqual('a', tenants['a'].get_dependency('tenant-name'))
+        new_client = tenants['a'].get_dependency('client')
+        self.assertIsNot(client, new_client)
+        self.assertIs(new_client[1], shared.get_dependency('sock'))
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'needs os.register_at_fork')
+    def test_tenant_resets_in_forked_child(self):
+        self.dependencies.register_factory('sock', object, fork_safe=False)
+        self.dependencies.register_factory('client', lambda n, s: (n, s),
+                                           dependencies=['tenant-name', 'sock'])
+        _, tenants = self.dependencies.build_injectors({'a': {'tenant-name': 'a'}})
+        tenants['a'].get_dependency('client')
+        pid = os.fork()
+        if pid == 0:
+            cache = tenants['a']._value_cache
+            ok = 'client' not in cache and cache.get('tenant-name') == 'a'
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertIn('client', tenants['a']._value_cache)
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Dependencies()
+        self.db.register_value('db-host', 'localhost')
+        self.db.register_factory('db', lambda host: 'db@' + host, dependencies=['db-host'])
+        self.app = Dependencies()
+        self.app.register_factory('handler', lambda db: 'handler(' + db + ')',
+                                  dependencies=['db'])
+
+    def test_merge(self):
+        inj = Dependencies.merge(self.db, self.app).build_injector()
+        self.assertEqual(inj.get_dependency('handler'), 'handler(db@localhost)')
+
+    def test_build_injector_with_modules(self):
+        inj = self.app.build_injector(roots=['handler'], modules=[self.db])
+        self.assertEqual(inj.get_dependency('handler'), 'handler(db@localhost)')
+
+    def test_only_checks_modules_once(self):
+        Dependencies.merge(self.db, self.app)
+        self.assertEqual(self.app._unchecked_names(), [])
+        merged = Dependencies.merge(self.db, self.app)
+        self.assertEqual(merged._unchecked_names(), ['handler'])
+
+    def test_catches_scope_errors_between_modules(self):
+        self.db.register_factory('session', lambda: 's', scope='request')
+        self.app.register_factory('cache', lambda s: s, dependencies=['session'])
+        with self.assertRaises(ScopeException):
+            Dependencies.merge(self.db, self.app).build_injector()
+
+    def test_catches_missing_dependency_between_modules(self):
+        with self.assertRaises(MissingDependencyException):
+            Dependencies.merge(self.app).build_injector()
+
+    def test_catches_cycle_between_modules(self):
+        other = Dependencies()
+        other.register_factory('db-host', lambda h: h, dependencies=['handler'])
+        self.db = Dependencies()
+        self.db.register_factory('db', lambda host: host, dependencies=['db-host'])
+        merged = Dependencies.merge(self.db, self.app, other)
+        with self.assertRaises(CircularDependencyException):
+            merged.build_injector()
+
+    def test_catches_cycle_inside_module(self):
+        self.app.register_factory('a', lambda b: b, dependencies=['b'])
+        self.app.register_factory('b', lambda a: a, dependencies=['a'])
+        with self.assertRaises(CircularDependencyException):
+            Dependencies.merge(self.db, self.app)
+
+    def test_rejects_duplicate_names(self):
+        self.app.register_value('db-host', 'elsewhere')
+        with self.assertRaises(DuplicateNameException):
+            Dependencies.merge(self.db, self.app)
+
+class FreezeTest(unittest.TestCase):
+    def setUp(self):
+        self.deps = self._dependencies()
+
+    def _dependencies(self):
+        deps = Dependencies()
+        deps.register_value('db-host', 'localhost')
+        deps.register_factory('db', lambda host: 'db@' + host, dependencies=['db-host'])
+        deps.register_factory('handler', lambda db: 'handler(' + db + ')',
+                              dependencies=['db'])
+        return deps
+
+    def test_freeze(self):
+        frozen = self.deps.freeze()
+        self.assertEqual(self.deps.content_hash(), frozen.digest())
+        self.assertEqual(['db-host', 'db', 'handler'], frozen.topological_order())
+
+    def test_freeze_checks_the_graph(self):
+        self.deps.register_factory('broken', lambda x: x, dependencies=['nothing'])
+        with self.assertRaises(MissingDependencyException):
+            self.deps.freeze()
+
+    def test_content_hash(self):
+        self.assertEqual(self.deps.content_hash(), self._dependencies().content_hash())
+        other = Dependencies()
+        other.register_factory('handler', lambda db: db, dependencies=['db'])
+        other.register_factory('db', lambda host: host, dependencies=['db-host'])
+        other.register_value('db-host', 'elsewhere')
+        self.assertEqual(self.deps.content_hash(), other.content_hash())
+
+        before = self.deps.content_hash()
+        self.deps.register_value('port', 5432)
+        self.assertNotEqual(before, self.deps.content_hash())
+        lazy_deps = Dependencies()
+        lazy_deps.register_value('db-host', 'localhost')
+        lazy_deps.register_factory('db', lambda host: host, dependencies=[lazy('db-host')])
+        lazy_deps.register_factory('handler', lambda db: db, dependencies=['db'])
+        self.assertNotEqual(self._dependencies().content_hash(), lazy_deps.content_hash())
+
+    def test_matching_snapshot_skips_checks(self):
+        snapshot = self._dependencies().freeze()
+        with mock.patch.object(DependencyGraph, 'validate', autospec=True,
+                               return_value=({}, [])) as validate:
+            inj = self.deps.build_injector(snapshot=snapshot)
+            self.assertEqual(inj.get_dependency('handler'), 'handler(db@localhost)')
+            self.deps.build_injector(roots=['handler'], snapshot=snapshot)
+        validate.assert_not_called()
+
+    def test_snapshot_of_other_cache_policies_is_ignored(self):
+        snapshot = self._dependencies().freeze()
+        self.deps = Dependencies()
+        self.deps.register_factory('db-host', lambda: 'localhost', cache=TTL(3600))
+        self.deps.register_factory('db', lambda host: 'db@' + host, dependencies=['db-host'])
+        self.deps.register_factory('handler', lambda db: 'handler(' + db + ')',
+                                   dependencies=['db'])
+        self.assertNotEqual(snapshot.digest(), self.deps.content_hash())
+        with self.assertRaises(ScopeException):
+            self.deps.build_injector(snapshot=snapshot)
+
+    def test_other_snapshot_is_ignored(self):
+        snapshot = self._dependencies().freeze()
+        self.deps.register_factory('a', lambda b: b, dependencies=['b'])
+        self.deps.register_factory('b', lambda a: a, dependencies=['a'])
+        with self.assertRaises(CircularDependencyException):
+            self.deps.build_injector(snapshot=snapshot)
+
 if __name__ == '__main__':
     unittest.main()
@@ -17,3 +17,27 @@ class MissingDependencyException(InjectorException):
 class CircularDependencyException(InjectorException):
     """ Raised when the dependencies defined are circular """
     pass
+
+class AsyncDependencyException(InjectorException):
+    """ Raised when an async dependency is requested without awaiting it """
+    pass
+
+class ScopeException(InjectorException):
+    """ Raised when a scope is unknown, or a singleton depends on a request-scoped value """
+    pass
+
+class CachePolicyException(InjectorException):
+    """ Raised when an unknown cache policy is used """
+    pass
+
+class PoolException(InjectorException):
+    """ Raised when a pool can't hand out an instance, or a name isn't a pool """
+    pass
+
+class SnapshotException(InjectorException):
+    """ Raised when a saved graph snapshot can't be read """
+    pass
+
+class ImportFactoryException(InjectorException):
+    """ Raised when a factory registered by its import path can't be imported """
+    pass
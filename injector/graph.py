@@ -1,4 +1,438 @@
-import collections
+from __future__ import absolute_import
+from array import array
+from collections import Counter
+from itertools import accumulate, chain, repeat
+import json
+import os
+import struct
+import sys
+
+from injector import exceptions
+
+class CompactGraph(object):
+    """ A read-only dependency graph stored in integer arrays, for whole-graph traversals.
+
+    Names are interned as the numbers 0 to n-1 (`names[i]` is the name of node i),
+    and the edges are stored in compressed sparse row form: the dependencies of node
+    i are `targets[offsets[i]:offsets[i + 1]]`. The edges in the other direction are
+    stored the same way by `reverse()`. Dependencies on names that aren't in the
+    graph are left out.
+    """
+
+    def __init__(self, graph, key=None):
+        """
+        :param graph: A dict mapping a dependency name to a list of zero or more
+                      things it depends on.
+        :param key: (optional) A function that gets the list from a value of the dict,
+                    if the values aren't the lists themselves
+        """
+        self.names = list(graph)
+        self.index = index = dict(zip(self.names, range(len(self.names))))
+
+        # The arrays are filled straight from the lists, without copying them all into
+        # Python lists first, so that building this for a large graph takes little
+        # more memory than the arrays themselves
+        def dependency_lists():
+            lists = map(graph.__getitem__, self.names)
+            return lists if key is None else map(key, lists)
+        self.offsets = array('i', [0])
+        self.offsets.extend(accumulate(map(len, dependency_lists())))
+        self.targets = array('i', map(index.get, chain.from_iterable(dependency_lists()),
+                                      repeat(-1)))
+        if -1 in self.targets:
+            self.offsets, self.targets = self._drop_missing(self.offsets, self.targets)
+
+        self._reverse = None
+        # Results of the traversals below, computed when first needed
+        self._depths = None
+        self._levels = None
+        self._closures = ({}, {})
+
+    @staticmethod
+    def _drop_missing(offsets, targets):
+        """ Leaves out the edges to names outside the graph (marked with -1).
+
+        :return: A tuple of new (offsets, targets) arrays
+        """
+        kept_offsets = array('i', [0])
+        kept = array('i')
+        for node in range(len(offsets) - 1):
+            kept.extend(t for t in targets[offsets[node]:offsets[node + 1]] if t != -1)
+            kept_offsets.append(len(kept))
+        return kept_offsets, kept
+
+    def __len__(self):
+        return len(self.names)
+
+    def dependencies(self, node):
+        """ :return: An array of the nodes that `node` depends on """
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def dependents(self, node):
+        """ :return: An array of the nodes that depend on `node` """
+        reverse_offsets, reverse_targets = self.reverse()
+        return reverse_targets[reverse_offsets[node]:reverse_offsets[node + 1]]
+
+    def reverse(self):
+        """ Gets the edges from dependencies to their dependents, built when first needed.
+
+        :return: A tuple (reverse_offsets, reverse_targets) of arrays, laid out like
+                 `offsets` and `targets`.
+        """
+        if self._reverse is None:
+            size = len(self.names)
+            targets = self.targets
+            lengths = map(int.__sub__, self.offsets[1:], self.offsets)
+            sources = array('i', chain.from_iterable(map(repeat, range(size), lengths)))
+            # A stable sort of the edges by target keeps each node's dependents in order
+            order = sorted(range(len(targets)), key=targets.__getitem__)
+            counts = Counter(targets)
+            reverse_offsets = array('i', [0])
+            reverse_offsets.extend(accumulate(map(counts.get, range(size), repeat(0))))
+            self._reverse = (reverse_offsets, array('i', map(sources.__getitem__, order)))
+        return self._reverse
+
+    def levels(self):
+        """ Groups the nodes into topological levels (see `DependencyGraph.levels()`).
+
+        :return: A list of lists of nodes, which is shared between calls.
+        :raises CircularDependencyException: if the graph contains a cycle.
+        """
+        if self._levels is None:
+            depths = self.depths()
+            levels = [[] for _ in range(max(depths, default=-1) + 1)]
+            for node, depth in enumerate(depths):
+                levels[depth].append(node)
+            self._levels = levels
+        return self._levels
+
+    def has_cycle(self):
+        """ :return: True if the graph contains a cycle """
+        if self._depths is None:
+            self._depths = self._find_depths()
+        return self._depths is False
+
+    def depths(self):
+        """ Finds the length of the longest chain of dependencies below each node.
+
+        :return: An array of depths, indexed by node.
+        :raises CircularDependencyException: if the graph contains a cycle.
+        """
+        if self.has_cycle():
+            raise exceptions.CircularDependencyException()
+        return self._depths
+
+    def closure(self, node, reverse=False):
+        """ Finds the nodes that can be reached from a node (not including itself,
+        unless it is on a cycle).
+
+        Results are kept, and later searches stop at nodes whose result is known, so
+        asking about many nodes doesn't walk the same part of the graph repeatedly.
+
+        :param node: The node to start from
+        :param reverse: If true, follow edges from dependencies to dependents
+        :return: A frozenset of nodes
+        """
+        known = self._closures[reverse]
+        found = known.get(node)
+        if found is not None:
+            return found
+        if reverse:
+            offsets, targets = self.reverse()
+        else:
+            offsets, targets = self.offsets, self.targets
+        result = set()
+        frontier = list(targets[offsets[node]:offsets[node + 1]])
+        while frontier:
+            current = frontier.pop()
+            if current in result:
+                continue
+            result.add(current)
+            below = known.get(current)
+            if below is not None:
+                result.update(below)
+            else:
+                frontier.extend(targets[offsets[current]:offsets[current + 1]])
+        found = known[node] = frozenset(result)
+        return found
+
+    def _find_depths(self):
+        """ Finds the depth of every node with a depth-first search that only follows
+        the forward edges.
+
+        :return: An array of depths, or False if the graph contains a cycle.
+        """
+        offsets = self.offsets
+        targets = self.targets
+        # -1 for nodes not visited yet, and -2 for nodes still being searched
+        depths = array('i', [-1]) * len(self.names)
+        for root in range(len(self.names)):
+            if depths[root] != -1:
+                continue
+            depths[root] = -2
+            work = [(root, offsets[root])]
+            while work:
+                node, position = work[-1]
+                end = offsets[node + 1]
+                while position < end and depths[targets[position]] >= 0:
+                    position += 1
+                if position < end:
+                    dependency = targets[position]
+                    if depths[dependency] == -2:
+                        return False
+                    work[-1] = (node, position + 1)
+                    depths[dependency] = -2
+                    work.append((dependency, offsets[dependency]))
+                    continue
+                work.pop()
+                below = map(depths.__getitem__, targets[offsets[node]:end])
+                depths[node] = max(below, default=-1) + 1
+        return depths
+
+    def reachable(self, nodes, reverse=False):
+        """ Finds the nodes reachable from the given ones (including themselves).
+
+        :param nodes: A list of nodes to start from
+        :param reverse: If true, follow edges from dependencies to dependents
+        :return: A list of nodes
+        """
+        if reverse:
+            offsets, targets = self.reverse()
+        else:
+            offsets, targets = self.offsets, self.targets
+        seen = bytearray(len(self.names))
+        found = []
+        frontier = list(nodes)
+        while frontier:
+            node = frontier.pop()
+            if seen[node]:
+                continue
+            seen[node] = 1
+            found.append(node)
+            frontier.extend(targets[offsets[node]:offsets[node + 1]])
+        return found
+
+    def cycles(self):
+        """ Finds a cycle in each strongly connected component that has one.
+
+        :return: A list of cycles, each a list of nodes like [a, b, a]
+        """
+        if not self.has_cycle():
+            return []
+        cycles = []
+        for component in self.strongly_connected_components():
+            node = component[0]
+            if len(component) > 1 or node in self.dependencies(node):
+                cycles.append(self._find_cycle(component))
+        return cycles
+
+    def _find_cycle(self, component):
+        """ Follows edges inside a strongly connected component until a node repeats. """
+        members = set(component)
+        node = component[0]
+        path = [node]
+        positions = {node: 0}
+        while True:
+            node = next(d for d in self.dependencies(node) if d in members)
+            if node in positions:
+                return path[positions[node]:] + [node]
+            positions[node] = len(path)
+            path.append(node)
+
+    def strongly_connected_components(self):
+        """ Tarjan's algorithm, using an explicit stack instead of recursion.
+
+        :return: A list of lists of nodes
+        """
+        size = len(self.names)
+        offsets = self.offsets
+        targets = self.targets
+        index = array('i', [-1]) * size
+        lowlink = array('i', [0]) * size
+        on_stack = bytearray(size)
+        stack = []
+        components = []
+        counter = 0
+        for root in range(size):
+            if index[root] != -1:
+                continue
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, offsets[root])]
+            while work:
+                node, position = work[-1]
+                end = offsets[node + 1]
+                while position < end:
+                    dependency = targets[position]
+                    position += 1
+                    if index[dependency] == -1:
+                        break
+                    if on_stack[dependency] and index[dependency] < lowlink[node]:
+                        lowlink[node] = index[dependency]
+                else:
+                    dependency = None
+                if dependency is not None:
+                    work[-1] = (node, position)
+                    index[dependency] = lowlink[dependency] = counter
+                    counter += 1
+                    stack.append(dependency)
+                    on_stack[dependency] = 1
+                    work.append((dependency, offsets[dependency]))
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        return components
+
+class FrozenGraph(object):
+    """ An immutable snapshot of a checked graph: the interned names, the dependency
+    edges (as in `CompactGraph`) and a topological order.
+
+    Snapshots are identified by a digest of the content they were made from, so a
+    snapshot saved by one process can tell another that an identical graph has
+    already been checked (see `Dependencies.freeze()`).
+    """
+
+    __slots__ = ('_digest', '_names', '_offsets', '_targets', '_order', '_index')
+
+    _MAGIC = b'INJGRAPH'
+    _VERSION = 1
+
+    def __init__(self, digest, names, offsets, targets, order):
+        """
+        :param digest: A string identifying the content of the graph
+        :param names: A sequence of the names of the nodes
+        :param offsets: An array('i') of offsets into targets (see `CompactGraph`)
+        :param targets: An array('i') of the dependencies of each node
+        :param order: An array('i') of the nodes in topological order
+        """
+        self._digest = digest
+        self._names = tuple(map(sys.intern, names))
+        self._offsets = array('i', offsets)
+        self._targets = array('i', targets)
+        self._order = array('i', order)
+        # Maps a name to its node, built the first time a node is looked up by name
+        self._index = None
+
+    @classmethod
+    def from_compact(cls, digest, compact):
+        """ Makes a snapshot of a CompactGraph.
+
+        :param digest: A string identifying the content of the graph
+        :param compact: A CompactGraph
+        :return: A FrozenGraph
+        :raises CircularDependencyException: if the graph contains a cycle.
+        """
+        order = [node for level in compact.levels() for node in level]
+        return cls(digest, compact.names, compact.offsets, compact.targets, order)
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenGraph) and self._digest == other.digest()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._digest)
+
+    def digest(self):
+        """ :return: The digest of the content the graph was made from """
+        return self._digest
+
+    def names(self):
+        """ :return: A tuple of the names of the nodes """
+        return self._names
+
+    def dependencies(self, name):
+        """ Lists the dependencies of a node that are in the graph.
+
+        :param name: The name of a node
+        :return: A list of names
+        :raises MissingDependencyException: if the name isn't in the graph
+        """
+        if self._index is None:
+            self._index = {node_name: node for node, node_name in enumerate(self._names)}
+        node = self._index.get(name)
+        if node is None:
+            raise exceptions.MissingDependencyException("Missing dependency name: {}".format(name))
+        return [self._names[i] for i in self._targets[self._offsets[node]:self._offsets[node + 1]]]
+
+    def topological_order(self):
+        """ :return: A list of the names, each one after all of its dependencies """
+        return [self._names[i] for i in self._order]
+
+    def save(self, path):
+        """ Writes the snapshot to a file. The file is replaced atomically, so processes
+        loading it at the same time see either the old or the new snapshot.
+
+        :param path: The path of the file
+        """
+        header = json.dumps({
+            'version': self._VERSION,
+            'digest': self._digest,
+            'names': self._names,
+            'itemsize': self._targets.itemsize,
+            'sizes': [len(self._offsets), len(self._targets), len(self._order)],
+        }).encode('utf-8')
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'wb') as output:
+            output.write(self._MAGIC)
+            output.write(struct.pack('<I', len(header)))
+            output.write(header)
+            for values in (self._offsets, self._targets, self._order):
+                if sys.byteorder == 'big':
+                    values = array('i', values)
+                    values.byteswap()
+                output.write(values.tobytes())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a snapshot written by `save()`.
+
+        :param path: The path of the file
+        :return: A FrozenGraph
+        :raises SnapshotException: if the file isn't a snapshot this version can read
+        """
+        with open(path, 'rb') as source:
+            data = source.read()
+        try:
+            if not data.startswith(cls._MAGIC):
+                raise ValueError("not a graph snapshot")
+            start = len(cls._MAGIC)
+            header_size, = struct.unpack_from('<I', data, start)
+            start += 4
+            header = json.loads(data[start:start + header_size].decode('utf-8'))
+            start += header_size
+            if header['version'] != cls._VERSION or header['itemsize'] != array('i').itemsize:
+                raise ValueError("unsupported snapshot format")
+            arrays = []
+            for size in header['sizes']:
+                values = array('i')
+                end = start + size * values.itemsize
+                if end > len(data):
+                    raise ValueError("snapshot is truncated")
+                values.frombytes(data[start:end])
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                arrays.append(values)
+                start = end
+        except (ValueError, KeyError, TypeError, struct.error) as error:
+            raise exceptions.SnapshotException("Can't load {}: {}".format(path, error))
+        return cls(header['digest'], header['names'], *arrays)
 
 class DependencyGraph(object):
     """ A generic dependency graph, useful for checking some properties """
@@ -9,46 +443,259 @@ class DependencyGraph(object):
         :param graph: A dict mapping a dependency name to a list of zero or more
                       things it depends on.
         """
-        self._graph = graph
+        self._graph = {}
+        # Maps a node to the set of its dependencies that didn't exist when the missing
+        # dependencies were last brought up to date
+        self._missing = {}
+        # Maps a name to the nodes that depend on it, built the first time only part of
+        # the graph is validated (a graph that is only validated once doesn't need it)
+        self._dependents = None
+        # Nodes added (or given a missing dependency) since the last successful validate()
+        self._unchecked = set()
+        # A CompactGraph of the whole graph, built when first needed
+        self._compact = None
+        for name, dependencies in graph.items():
+            self.add(name, dependencies)
+
+    def add(self, name, dependencies):
+        """ Adds a node to the graph.
+
+        :param name: The name of the new node
+        :param dependencies: A list of zero or more things it depends on
+        """
+        if name in self._graph:
+            raise exceptions.DuplicateNameException("Duplicate name: {}".format(name))
+        self._graph[name] = dependencies
+        self._compact = None
+        # Which of its dependencies are missing is worked out when the graph is checked,
+        # so that adding a node stays cheap
+        self._unchecked.add(name)
+        if self._dependents is not None:
+            self._add_dependents(self._dependents, name, dependencies)
+
+    def _update_missing(self):
+        """ Brings the missing dependencies of each node up to date with the nodes
+        added since the last time.
+        """
+        graph = self._graph
+        for name, missing in list(self._missing.items()):
+            found = [dependency for dependency in missing if dependency in graph]
+            if found:
+                missing.difference_update(found)
+                if not missing:
+                    del self._missing[name]
+                # A new cycle could go through it
+                self._unchecked.add(name)
+        for name in self._unchecked:
+            missing = [dependency for dependency in graph[name] if dependency not in graph]
+            if missing:
+                self._missing[name] = set(missing)
+
+    @staticmethod
+    def _add_dependents(index, name, dependencies):
+        for dependency in dependencies:
+            dependents = index.get(dependency)
+            if dependents is None:
+                index[dependency] = [name]
+            else:
+                dependents.append(name)
+
+    def merge(self, other):
+        """ Adds all the nodes of another graph to this one.
+
+        Nodes that the other graph already checked, and that only depend on nodes in
+        that graph, aren't checked again by `validate()`. A new cycle has to pass
+        through one of the other nodes, so only the edges between the graphs need to
+        be checked.
+
+        :param other: A DependencyGraph with none of the same names as this one
+        """
+        for name in other._graph: #pylint: disable=W0212
+            if name in self._graph:
+                raise exceptions.DuplicateNameException("Duplicate name: {}".format(name))
+        other._update_missing() #pylint: disable=W0212
+        for name, dependencies in other._graph.items(): #pylint: disable=W0212
+            self.add(name, dependencies)
+        for name in other._graph: #pylint: disable=W0212
+            if name not in other._unchecked and name not in other._missing: #pylint: disable=W0212
+                self._unchecked.discard(name)
+
+    def nodes(self):
+        """ Lists the names of the nodes in the graph.
+
+        :return: A list of names
+        """
+        return list(self._graph)
+
+    def mark_checked(self):
+        """ Records that the whole graph is known to be valid (e.g. because it matches a
+        snapshot of a graph that was checked before), so `validate()` doesn't check
+        the current nodes again.
+        """
+        self._unchecked.clear()
+
+    def freeze(self, digest):
+        """ Makes an immutable snapshot of the graph.
+
+        :param digest: A string identifying the content of the graph
+        :return: A FrozenGraph
+        :raises CircularDependencyException: if the graph contains a cycle.
+        """
+        return FrozenGraph.from_compact(digest, self.compact())
+
+    def compact(self):
+        """ Gets the graph in integer-indexed form, for traversing all of it.
+
+        :return: A CompactGraph, which is reused until the next `add()`
+        """
+        if self._compact is None:
+            self._compact = CompactGraph(self._graph)
+        return self._compact
+
+    def unchecked_names(self):
+        """ Lists the nodes that changed since the last successful `validate()`,
+        including the nodes whose missing dependencies have since been added.
+
+        :return: A set of names
+        """
+        self._update_missing()
+        return set(self._unchecked)
+
+    def subgraph(self, roots):
+        """ Makes a new graph of the nodes reachable from the given ones.
+
+        :param roots: A list of names in this graph
+        :return: A DependencyGraph
+        """
+        reachable = {}
+        frontier = [name for name in roots if name in self._graph]
+        while frontier:
+            name = frontier.pop()
+            if name in reachable:
+                continue
+            reachable[name] = self._graph[name]
+            frontier.extend(d for d in self._graph[name] if d in self._graph)
+        return DependencyGraph(reachable)
+
+    def validate(self):
+        """ Finds all the missing dependencies and cycles in the graph.
+
+        Only the part of the graph that changed since the last successful call is
+        searched for cycles: any new cycle has to pass through a node that was added
+        (or that depended on a name that was just added), so only the nodes that can
+        reach one of those are checked, in a single pass of Tarjan's algorithm.
+
+        A graph with missing dependencies but no cycles counts as checked, so it can
+        be `merge()`d into another graph that has those dependencies without being
+        checked again.
+
+        :return: A tuple (missing, cycles), where missing is a dict mapping names to
+                 the sorted list of their dependencies that don't exist, and cycles is
+                 a list of paths like ['a', 'b', 'a']. Both are empty if the graph is
+                 valid.
+        """
+        self._update_missing()
+        if len(self._unchecked) == len(self._graph):
+            # Not kept as self._compact, since most graphs are only validated
+            compact = self._compact or CompactGraph(self._graph)
+        else:
+            if self._dependents is None:
+                self._dependents = {}
+                for name, dependencies in self._graph.items():
+                    self._add_dependents(self._dependents, name, dependencies)
+            region = set(self._unchecked)
+            frontier = list(region)
+            while frontier:
+                for dependent in self._dependents.get(frontier.pop(), ()):
+                    if dependent not in region:
+                        region.add(dependent)
+                        frontier.append(dependent)
+            compact = CompactGraph({name: self._graph[name] for name in region})
+        cycles = [[compact.names[i] for i in cycle] for cycle in compact.cycles()]
+        missing = {
+            name: sorted(dependencies)
+            for name, dependencies in self._missing.items()
+        }
+        # Missing dependencies are always reported (and adding one marks the nodes that
+        # need it), so the nodes only have to be checked again for cycles
+        if not cycles:
+            self._unchecked.clear()
+        return missing, cycles
 
     def has_missing_dependencies(self):
         """ Checks to see if the graph contains any references to nodes that don't exist.
 
         :return: True if there are missing dependencies.
         """
-        for dependencies in self._graph.values():
-            for dependency in dependencies:
-                if dependency not in self._graph:
-                    return True
-        return False
+        self._update_missing()
+        return bool(self._missing)
+
+    def _node(self, name):
+        """ Finds the number of a name in the compact graph. """
+        compact = self.compact()
+        node = compact.index.get(name)
+        if node is None:
+            raise exceptions.MissingDependencyException("Missing dependency name: {}".format(name))
+        return compact, node
+
+    def transitive_dependencies(self, name):
+        """ Finds everything a node depends on, directly or indirectly.
+
+        Dependencies that aren't in the graph are left out. Like the other queries
+        below, the result is kept until the next `add()`, and is reused to answer
+        later queries.
+
+        :param name: The name of a node in the graph
+        :return: A frozenset of names
+        """
+        compact, node = self._node(name)
+        return frozenset(map(compact.names.__getitem__, compact.closure(node)))
+
+    def transitive_dependents(self, name):
+        """ Finds every node that depends on the given one, directly or indirectly.
+
+        :param name: The name of a node in the graph
+        :return: A frozenset of names
+        """
+        compact, node = self._node(name)
+        return frozenset(map(compact.names.__getitem__, compact.closure(node, reverse=True)))
+
+    def depth(self, name):
+        """ Finds the length of the longest chain of dependencies below a node (0 if it
+        doesn't depend on anything in the graph).
+
+        :param name: The name of a node in the graph
+        :return: An int
+        :raises CircularDependencyException: if the graph contains a cycle.
+        """
+        compact, node = self._node(name)
+        return compact.depths()[node]
+
+    def topological_order(self):
+        """ Lists the nodes so that each one comes after all of its dependencies.
+
+        :return: A list of names
+        :raises CircularDependencyException: if the graph contains a cycle.
+        """
+        compact = self.compact()
+        return [compact.names[node] for level in compact.levels() for node in level]
 
     def has_circular_dependencies(self):
         """ Checks to see if the graph contains any cycles.
 
         :return: True if there is a cycle.
         """
-        dep_counts = {
-            name: len(dependencies)
-            for name, dependencies in self._graph.items()
-        }
+        return self.compact().has_cycle()
 
-        depends_on = collections.defaultdict(set)
-        for name, dependencies in self._graph.items():
-            for dependency in dependencies:
-                depends_on[dependency].add(name)
-
-        deps_met = collections.deque(
-            name for name, dependencies in self._graph.items()
-            if len(dependencies) == 0
-        )
-
-        num_removed = 0
-        while deps_met:
-            num_removed += 1
-            done = deps_met.pop()
-            for name in depends_on[done]:
-                dep_counts[name] -= 1
-                if dep_counts[name] == 0:
-                    deps_met.append(name)
-
-        return num_removed < len(self._graph)
+    def levels(self):
+        """ Groups the nodes into topological levels.
+
+        Nodes in level 0 have no dependencies, and every other node is in the level
+        after the deepest of its dependencies, so the nodes within a level never
+        depend on each other. Dependencies that aren't in the graph are ignored.
+
+        :return: A list of lists of names, ordered from the first level to the last.
+        :raises CircularDependencyException: if the graph contains a cycle.
+        """
+        compact = self.compact()
+        return [[compact.names[i] for i in level] for level in compact.levels()]
@@ -2,9 +2,15 @@
 #pylint: disable=C0103
 
 from __future__ import absolute_import
+import os
+import tempfile
 import unittest
 
-from injector.graph import DependencyGraph
+from injector.exceptions import CircularDependencyException
+from injector.exceptions import DuplicateNameException
+from injector.exceptions import MissingDependencyException
+from injector.exceptions import SnapshotException
+from injector.graph import CompactGraph, DependencyGraph, FrozenGraph
 
 class MissingDependenciesTest(unittest.TestCase):
     def _assert_result_for_graph_is(self, result, graph):
@@ -56,5 +62,271 @@ class CircularDependenciesTest(unittest.TestCase):
             'd': ['b'],
         })
 
+class ValidateTest(unittest.TestCase):
+    def test_valid_graph(self):
+        graph = DependencyGraph({'a': ['b'], 'b': []})
+        self.assertEqual(({}, []), graph.validate())
+        self.assertEqual(set(), graph.unchecked_names())
+
+    def test_reports_all_missing_dependencies(self):
+        graph = DependencyGraph({'a': ['b', 'x'], 'b': ['y'], 'c': ['x']})
+        missing, _ = graph.validate()
+        self.assertEqual({'a': ['x'], 'b': ['y'], 'c': ['x']}, missing)
+
+    def test_reports_cycle_paths(self):
+        graph = DependencyGraph({
+            'a': ['b'],
+            'b': ['c'],
+            'c': ['a'],
+            'd': ['d'],
+            'e': ['a'],
+        })
+        _, cycles = graph.validate()
+        self.assertEqual(2, len(cycles))
+        for cycle in cycles:
+            self.assertEqual(cycle[0], cycle[-1])
+        self.assertEqual([['a', 'b', 'c'], ['d']], sorted(sorted(c[1:]) for c in cycles))
+
+    def test_adding_missing_dependency_fixes_graph(self):
+        graph = DependencyGraph({'a': ['b']})
+        self.assertEqual({'a': ['b']}, graph.validate()[0])
+        graph.add('b', [])
+        self.assertEqual(({}, []), graph.validate())
+
+    def test_only_checks_changed_nodes(self):
+        graph = DependencyGraph({'a': ['b'], 'b': [], 'c': []})
+        graph.validate()
+        graph.add('d', ['c'])
+        self.assertEqual(set(['d']), graph.unchecked_names())
+        self.assertEqual(({}, []), graph.validate())
+
+    def test_rechecks_node_when_missing_dependency_is_added(self):
+        graph = DependencyGraph({'a': ['b'], 'c': []})
+        graph.validate()
+        graph.add('b', [])
+        self.assertEqual(set(['a', 'b']), graph.unchecked_names())
+
+    def test_finds_cycle_closed_by_new_node(self):
+        graph = DependencyGraph({'c': []})
+        graph.validate()
+        graph.add('a', ['b', 'c'])
+        graph.add('b', ['a'])
+        self.assertEqual(set(['a', 'b']), graph.unchecked_names())
+        _, cycles = graph.validate()
+        self.assertEqual(1, len(cycles))
+        self.assertEqual(set(['a', 'b']), graph.unchecked_names())
+
+class MergeTest(unittest.TestCase):
+    def test_only_checks_edges_between_graphs(self):
+        first = DependencyGraph({'a': [], 'b': ['a'], 'c': ['x']})
+        second = DependencyGraph({'x': ['y'], 'y': []})
+        self.assertEqual({'c': ['x']}, first.validate()[0])
+        second.validate()
+
+        graph = DependencyGraph({})
+        graph.merge(first)
+        graph.merge(second)
+        self.assertEqual(set(['c']), graph.unchecked_names())
+        self.assertEqual(({}, []), graph.validate())
+
+    def test_finds_cycles_across_graphs(self):
+        first = DependencyGraph({'a': ['b'], 'c': []})
+        second = DependencyGraph({'b': ['a']})
+        first.validate()
+        second.validate()
+
+        graph = DependencyGraph({})
+        graph.merge(first)
+        graph.merge(second)
+        _, cycles = graph.validate()
+        self.assertEqual([['a', 'b']], [sorted(cycle[1:]) for cycle in cycles])
+
+    def test_rejects_duplicate_names(self):
+        graph = DependencyGraph({'a': []})
+        with self.assertRaises(DuplicateNameException):
+            graph.merge(DependencyGraph({'b': [], 'a': []}))
+        self.assertEqual(['a'], graph.nodes())
+
+class SubgraphTest(unittest.TestCase):
+    def test_keeps_reachable_nodes(self):
+        graph = DependencyGraph({
+            'a': ['b', 'missing'],
+            'b': ['c'],
+            'c': [],
+            'd': ['a'],
+        }).subgraph(['a', 'unknown'])
+        self.assertEqual(['a', 'b', 'c'], sorted(graph.nodes()))
+        self.assertEqual({'a': ['missing']}, graph.validate()[0])
+
+class LevelsTest(unittest.TestCase):
+    def _levels(self, graph):
+        return [sorted(level) for level in DependencyGraph(graph).levels()]
+
+    def test_empty_graph_has_no_levels(self):
+        self.assertEqual([], self._levels({}))
+
+    def test_groups_independent_nodes(self):
+        self.assertEqual([['a', 'b', 'c'], ['d'], ['e']], self._levels({
+            'a': [],
+            'b': [],
+            'c': [],
+            'd': ['a', 'b'],
+            'e': ['d', 'c'],
+        }))
+
+    def test_rejects_cycles(self):
+        with self.assertRaises(CircularDependencyException):
+            DependencyGraph({'a': ['b'], 'b': ['a']}).levels()
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = DependencyGraph({
+            'a': [],
+            'b': ['a', 'x'],
+            'c': ['a'],
+            'd': ['b', 'c'],
+        })
+
+    def test_transitive_dependencies(self):
+        self.assertEqual(frozenset(['a', 'b', 'c']), self.graph.transitive_dependencies('d'))
+        self.assertEqual(frozenset(['a']), self.graph.transitive_dependencies('b'))
+        self.assertEqual(frozenset(), self.graph.transitive_dependencies('a'))
+
+    def test_transitive_dependents(self):
+        self.assertEqual(frozenset(['b', 'c', 'd']), self.graph.transitive_dependents('a'))
+        self.assertEqual(frozenset(), self.graph.transitive_dependents('d'))
+
+    def test_reuses_results_until_a_node_is_added(self):
+        self.assertEqual(frozenset(['a']), self.graph.transitive_dependencies('b'))
+        self.graph.add('x', ['c'])
+        self.assertEqual(frozenset(['a', 'c', 'x']), self.graph.transitive_dependencies('b'))
+
+    def test_cycles(self):
+        graph = DependencyGraph({'a': ['b'], 'b': ['a'], 'c': ['a']})
+        self.assertEqual(frozenset(['a', 'b']), graph.transitive_dependencies('a'))
+        self.assertEqual(frozenset(['a', 'b']), graph.transitive_dependencies('c'))
+        with self.assertRaises(CircularDependencyException):
+            graph.topological_order()
+        with self.assertRaises(CircularDependencyException):
+            graph.depth('c')
+
+    def test_topological_order(self):
+        order = self.graph.topological_order()
+        self.assertEqual(['a', 'b', 'c', 'd'], sorted(order))
+        for name in order:
+            for dependency in self.graph.transitive_dependencies(name):
+                self.assertLess(order.index(dependency), order.index(name))
+
+    def test_depth(self):
+        self.assertEqual([0, 1, 1, 2], [self.graph.depth(name) for name in 'abcd'])
+
+    def test_unknown_name(self):
+        with self.assertRaises(MissingDependencyException):
+            self.graph.depth('x')
+
+class CompactGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = CompactGraph({'a': ['b', 'c', 'x'], 'b': ['c'], 'c': [], 'd': ['c']})
+
+    def _names(self, nodes):
+        return sorted(self.graph.names[node] for node in nodes)
+
+    def test_stores_edges_both_ways_without_missing_names(self):
+        a, c = self.graph.index['a'], self.graph.index['c']
+        self.assertEqual(['b', 'c'], self._names(self.graph.dependencies(a)))
+        self.assertEqual(['a', 'b', 'd'], self._names(self.graph.dependents(c)))
+
+    def test_reachable(self):
+        c = self.graph.index['c']
+        self.assertEqual(['c'], self._names(self.graph.reachable([c])))
+        reachable = self.graph.reachable([c], reverse=True)
+        self.assertEqual(['a', 'b', 'c', 'd'], self._names(reachable))
+
+    def test_levels(self):
+        self.assertEqual([['c'], ['b', 'd'], ['a']],
+                         [self._names(level) for level in self.graph.levels()])
+
+    def test_strongly_connected_components(self):
+        graph = CompactGraph({'a': ['b'], 'b': ['c'], 'c': ['a'], 'd': ['a']})
+        components = sorted(
+            sorted(graph.names[node] for node in component)
+            for component in graph.strongly_connected_components()
+        )
+        self.assertEqual([['a', 'b', 'c'], ['d']], components)
+        self.assertTrue(graph.has_cycle())
+        self.assertFalse(self.graph.has_cycle())
+
+    def test_key_gets_the_dependency_lists(self):
+        graph = CompactGraph({'a': (len, ['b', 'x']), 'b': (len, [])}, key=lambda spec: spec[1])
+        self.assertEqual(['b'], [graph.names[node] for node in graph.dependencies(0)])
+        self.assertEqual([], list(graph.dependencies(1)))
+
+    def test_cycles(self):
+        self.assertEqual([], self.graph.cycles())
+        graph = CompactGraph({'a': ['b'], 'b': ['a'], 'c': ['c'], 'd': ['a']})
+        cycles = sorted([graph.names[node] for node in cycle] for cycle in graph.cycles())
+        self.assertEqual(['c', 'c'], cycles[-1])
+        self.assertEqual(3, len(cycles[0]))
+        self.assertEqual(cycles[0][0], cycles[0][-1])
+
+class FrozenGraphTest(unittest.TestCase):
+    def setUp(self):
+        graph = DependencyGraph({'a': ['b', 'c'], 'b': ['c'], 'c': [], 'd': ['c']})
+        self.frozen = graph.freeze('digest')
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'graph.snapshot')
+        self.addCleanup(os.rmdir, directory)
+
+    def test_freeze(self):
+        self.assertEqual('digest', self.frozen.digest())
+        self.assertEqual(['b', 'c'], sorted(self.frozen.dependencies('a')))
+        order = self.frozen.topological_order()
+        self.assertEqual(['a', 'b', 'c', 'd'], sorted(order))
+        self.assertLess(order.index('b'), order.index('a'))
+        self.assertLess(order.index('c'), order.index('b'))
+
+    def test_dependencies_of_each_node(self):
+        self.assertEqual([], self.frozen.dependencies('c'))
+        self.assertEqual(['c'], self.frozen.dependencies('d'))
+        self.assertEqual(['c'], self.frozen.dependencies('b'))
+        with self.assertRaises(MissingDependencyException):
+            self.frozen.dependencies('e')
+
+    def test_freeze_rejects_cycle(self):
+        with self.assertRaises(CircularDependencyException):
+            DependencyGraph({'a': ['b'], 'b': ['a']}).freeze('digest')
+
+    def test_hashable_by_digest(self):
+        other = DependencyGraph({'x': []}).freeze('digest')
+        self.assertEqual(self.frozen, other)
+        self.assertEqual(1, len({self.frozen, other}))
+        self.assertNotEqual(self.frozen, DependencyGraph({}).freeze('other'))
+
+    def test_save_and_load(self):
+        self.frozen.save(self.path)
+        self.addCleanup(os.remove, self.path)
+        loaded = FrozenGraph.load(self.path)
+        self.assertEqual(self.frozen, loaded)
+        self.assertEqual(self.frozen.names(), loaded.names())
+        self.assertEqual(self.frozen.topological_order(), loaded.topological_order())
+        self.assertEqual(['c'], loaded.dependencies('b'))
+
+    def test_load_rejects_other_files(self):
+        with open(self.path, 'wb') as output:
+            output.write(b'not a snapshot')
+        self.addCleanup(os.remove, self.path)
+        with self.assertRaises(SnapshotException):
+            FrozenGraph.load(self.path)
+
+    def test_load_rejects_truncated_file(self):
+        self.frozen.save(self.path)
+        self.addCleanup(os.remove, self.path)
+        with open(self.path, 'rb') as source:
+            data = source.read()
+        with open(self.path, 'wb') as output:
+            output.write(data[:-4])
+        with self.assertRaises(SnapshotException):
+            FrozenGraph.load(self.path)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,19 +1,195 @@
 from __future__ import absolute_import
+import concurrent.futures
+import functools
+import threading
+import time
 
+from injector import caching, deferred, graph, introspection, metrics, timing
+from injector.caching import MISSING
+from injector.lifecycle import LifecycleMixin
+from injector.lifecycle import _NO_OPTIONS, _cache_policy, _fork_aware_injectors, _options
+from injector.lifecycle import _start_generator
+from injector.proxy import Lazy, LazyProxy
+from injector.exceptions import AsyncDependencyException
+from injector.exceptions import CircularDependencyException
 from injector.exceptions import MissingDependencyException
 
-class Injector(object):
+SINGLETON = 'singleton'
+REQUEST = 'request'
+
+def is_request_scoped(spec):
+    """ Checks if a factory spec (a tuple of the form used by `Injector`) is request-scoped.
+
+    :param spec: A tuple of (factory fn, [dependency name], options)
+    :return: True if the factory builds one value per child injector
+    """
+    return _options(spec).get('scope') == REQUEST
+
+def is_shared(spec):
+    """ Checks if a factory spec is marked as the same for every tenant.
+
+    :param spec: A tuple of (factory fn, [dependency name], options)
+    :return: True if the factory was registered with shared=True
+    """
+    return bool(_options(spec).get('shared'))
+
+def _check_not_async(name, spec):
+    if _options(spec).get('async'):
+        raise AsyncDependencyException(
+            "Async dependency must be awaited with aget_dependency: {}".format(name))
+
+class Injector(LifecycleMixin):
     """ An injector filled with dependencies, ready to inject. """
 
-    def __init__(self, factories):
+    def __init__(self, factories, parent=None, overrides=None, local_names=None,
+                 request_names=None, pool_names=None, fork_unsafe_names=None):
         """ Create an Injector.
 
-        The prefered way to create an Injector is with `Dependencies.build_injector()`.
+        The prefered way to create an Injector is with `Dependencies.build_injector()`,
+        and the prefered way to create a child injector is with `Injector.child()`.
 
-        :param factories: A dict of the form {name: (factory fn, [dependency name])}
+        :param factories: A dict of the form {name: (factory fn, [dependency name])}.
+                          The tuples may have a third element, a dict of options
+                          (e.g. {'async': True} for async factories, or
+                          {'cache': caching.TTL(60)} for values that expire).
+        :param parent: (optional) The injector to get singleton values from.
+        :param overrides: (optional) A dict of values to use instead of the factories.
+        :param local_names: (optional) The names a child builds itself, instead of
+                            getting them from the parent (by default, the
+                            request-scoped names). Request-scoped names are always
+                            included.
+        :param request_names: (optional) The names of the request-scoped factories, if
+                              they are already known (e.g. by `Dependencies`), so that
+                              they don't have to be looked for. Likewise pool_names
+                              (factories registered with `register_pool`) and
+                              fork_unsafe_names (factories with fork_safe=False).
+                              Children always get these from the parent.
         """
         self._factories = factories
-        self._value_cache = {}
+        self._parent = parent
+        self._value_cache = dict(overrides) if overrides else {}
+        self._overrides = overrides or {}
+        self._tasks = {}
+        self._stores = {}
+        self._finalizers = {}
+        # The names whose values are being built, and by which thread
+        self._claims = {}
+        self._lock = threading.Lock()
+        # Notified when a claim is released, if any thread is waiting for one
+        self._released = threading.Condition(self._lock)
+        self._waiting = 0
+        self._fork_unsafe = None
+        # The names that aget_dependency() has found to be resolvable
+        self._checked = set()
+        if parent is None:
+            self._graph = None
+            if request_names is None:
+                request_names = (
+                    name for name, spec in factories.items() if is_request_scoped(spec)
+                )
+            if pool_names is None:
+                pool_names = (
+                    name for name, spec in factories.items() if _options(spec).get('pool')
+                )
+            if fork_unsafe_names is None:
+                fork_unsafe_names = (
+                    name for name, spec in factories.items()
+                    if _options(spec).get('fork_safe') is False
+                )
+            self._request_names = frozenset(request_names)
+            self._pool_names = frozenset(pool_names)
+            self._fork_unsafe_names = frozenset(fork_unsafe_names)
+            self._timings = None
+            self._metrics = None
+            if self._fork_unsafe_names:
+                _fork_aware_injectors.add(self)
+        else:
+            self._request_names = parent._request_names #pylint: disable=W0212
+            self._pool_names = parent._pool_names #pylint: disable=W0212
+            self._fork_unsafe_names = parent._fork_unsafe_names #pylint: disable=W0212
+            self._timings = parent._timings #pylint: disable=W0212
+            self._metrics = parent._metrics #pylint: disable=W0212
+        if local_names is None:
+            self._local_names = self._request_names
+        else:
+            # A long-lived child (e.g. one per tenant), so it is reset after forking too
+            self._local_names = self._request_names | frozenset(local_names)
+            # The parent is reset after forking if any factory isn't fork safe, and this
+            # is too if it builds one of them or something that depends on one
+            if parent in _fork_aware_injectors:
+                unsafe = parent.prepare_fork()
+                if not unsafe.isdisjoint(self._local_names):
+                    self._fork_unsafe = unsafe
+                    _fork_aware_injectors.add(self)
+        for name in self._value_cache:
+            if name not in factories:
+                raise MissingDependencyException("Missing dependency name: {}".format(name))
+
+    def child(self, overrides=None):
+        """ Create a child injector, e.g. for handling a single request.
+
+        The child gets singleton values from this injector, and builds its own values
+        for request-scoped dependencies. Creating a child doesn't copy anything, so it
+        takes the same time no matter how many dependencies there are.
+
+        :param overrides: (optional) A dict of {name: value} to use in the child instead
+                          of the factories. Singletons are always built by the parent,
+                          so only request-scoped values and direct lookups see these.
+        :return: Injector
+        """
+        return Injector(self._factories, parent=self, overrides=overrides)
+
+    def enable_timing(self):
+        """ Start recording how long each factory takes to run.
+
+        Child injectors created afterwards record into the same measurements.
+        """
+        if self._timings is None:
+            self._timings = timing.Timings()
+
+    def enable_metrics(self):
+        """ Start counting cache hits and misses, factory calls and failures for each
+        name, and how deep each lookup has to go.
+
+        Child injectors created afterwards count into the same metrics.
+
+        :return: The `metrics.Metrics`, whose `snapshot()` and `prometheus_text()`
+                 report the counts.
+        """
+        if self._metrics is None:
+            self._metrics = metrics.Metrics()
+        return self._metrics
+
+    def startup_report(self):
+        """ Summarize the time spent running factories since `enable_timing()` was called.
+
+        :return: A dict with the keys 'factories' (a dict of {name: {'calls', 'errors',
+                 'wall_time', 'self_time'}}), 'total_time', 'critical_path' (the list
+                 of names on the slowest chain of dependencies) and 'critical_path_time'.
+        """
+        stats = self._timings.snapshot() if self._timings is not None else {}
+        return timing.startup_report(stats, {
+            name: self._factories[name][1] for name in stats
+        })
+
+    def _get_graph(self):
+        """ Gets the graph of the dependencies that factories get as values (leaving out
+        lazy ones, since those always get a proxy that fetches the current value).
+
+        :return: A CompactGraph, shared with child injectors
+        """
+        if self._parent is not None:
+            return self._parent._get_graph() #pylint: disable=W0212
+        if self._graph is None:
+            self._graph = graph.CompactGraph({
+                name: [d for d in spec[1] or () if not isinstance(d, Lazy)]
+                for name, spec in self._factories.items()
+            })
+        return self._graph
+
+    def _owns(self, name):
+        """ Checks if this injector (rather than its parent) builds the value of a name. """
+        return self._parent is None or name in self._local_names
 
     def has_dependency(self, name):
         """ Check if the Injector has a dependency.
@@ -29,18 +205,593 @@ class Injector(object):
         :param name: The name of the dependency
         :return: the value of the dependency
         """
-        if not self.has_dependency(name):
+        value = self._value_cache.get(name, MISSING)
+        if value is not MISSING:
+            if self._metrics is not None:
+                self._metrics.count(name, metrics.HITS)
+            return value
+        # A name marked with lazy() is looked up as the plain name, so that the marker
+        # doesn't end up in the cache (or in a proxy that would look it up lazily again)
+        name = str(name)
+        if self._parent is not None and name not in self._local_names:
+            return self._parent.get_dependency(name)
+        spec = self._factories.get(name)
+        if spec is None:
             raise MissingDependencyException("Missing dependency name: {}".format(name))
-        if name not in self._value_cache:
-            self._value_cache[name] = self.inject(*self._factories[name])
-        return self._value_cache[name]
+        policy = spec[2].get('cache') if len(spec) > 2 else None
+        if policy is not None:
+            value = self._get_store(policy).get(name)
+            if value is not MISSING:
+                if self._metrics is not None:
+                    self._metrics.count(name, metrics.HITS)
+                return value
+        return self._build(name, spec, policy, {}, {} if self._metrics is not None else None)
+
+    def get_lazy(self, name):
+        """ Get a proxy for a dependency, which builds the value on first use.
 
-    def inject(self, function, dependencies):
+        :param name: The name of the dependency
+        :return: a `LazyProxy` (or the value itself, if it has already been built)
+        """
+        value = self._value_cache.get(name, MISSING)
+        if value is not MISSING:
+            return value
+        if name not in self._factories:
+            raise MissingDependencyException("Missing dependency name: {}".format(name))
+        return LazyProxy(self, str(name))
+
+    def _get_argument(self, dependency):
+        if isinstance(dependency, Lazy):
+            return self.get_lazy(dependency)
+        return self.get_dependency(dependency)
+
+    def inject(self, function, dependencies=None):
         """ Calls the function with the value of the listed dependencies.
 
         :param function: The function that will be called
-        :param dependencies: A list of names of dependencies to inject into the function
+        :param dependencies: (optional) A list of names of dependencies to inject into
+                             the function (names wrapped with `lazy()` are injected as
+                             proxies). If not given, they are taken from the function's
+                             signature (see `introspection.infer_dependencies`).
         :return: The result of calling the function.
         """
-        args = [self.get_dependency(d) for d in dependencies] if dependencies else []
+        if dependencies is None:
+            dependencies = introspection.infer_dependencies(function)
+        if not dependencies:
+            return function()
+        if self._pool_names and not self._pool_names.isdisjoint(dependencies):
+            return self._call_with_checkouts(function, dependencies, (), {})
+        args = [self._get_argument(d) for d in dependencies]
         return function(*args) #pylint: disable=W0142
+
+    def get_dependencies(self, names):
+        """ Get the values of several dependencies.
+
+        Everything the names depend on (that isn't already cached) is put in a single
+        order and built once, instead of walking the graph separately for each name.
+
+        :param names: A list of names of dependencies
+        :return: a tuple of the values, in the same order as the names
+        """
+        return tuple(self._resolve(names))
+
+    def bind(self, function, dependencies):
+        """ Binds a function to its dependencies, for calling it many times.
+
+        If all the values are kept forever (i.e. they are singletons, or wrapped with
+        `lazy()`), they are fetched now and the result is a `functools.partial`, which
+        costs about the same to call as the function itself. Otherwise the names are
+        checked now and the values are fetched on every call.
+
+        :param function: The function to bind
+        :param dependencies: A list of names of dependencies to inject into the function
+        :return: A callable. Any arguments it is called with are passed to the function
+                 after the dependencies.
+        """
+        return self.bind_many([(function, dependencies)])[0]
+
+    def bind_many(self, functions):
+        """ Binds several functions at once, checking and fetching all their dependencies
+        in a single pass over the graph. See `bind()`.
+
+        :param functions: A list of (function, [dependency name]) tuples
+        :return: A list of callables, in the same order
+        """
+        functions = [(function, list(dependencies or ())) for function, dependencies in functions]
+        self._compile_plan([d for _, dependencies in functions for d in dependencies])
+
+        kept = [
+            all(self._keeps_forever(d) for d in dependencies)
+            for _, dependencies in functions
+        ]
+        root_values = iter(self.get_dependencies([
+            d for (_, dependencies), keep in zip(functions, kept) if keep
+            for d in dependencies
+        ]))
+
+        bound = []
+        for (function, dependencies), keep in zip(functions, kept):
+            if keep:
+                args = [next(root_values) for _ in dependencies]
+                bound.append(functools.partial(function, *args))
+            else:
+                bound.append(BoundFunction(self, function, dependencies))
+        return bound
+
+    def _keeps_forever(self, dependency):
+        if isinstance(dependency, Lazy):
+            return True
+        # Pool instances are checked out for each call
+        return _cache_policy(self._factories[dependency]) is None and \
+            dependency not in self._pool_names
+
+    def preimport(self, names=None, background=True):
+        """ Imports the modules of factories registered by their import path (see
+        `Dependencies.register_factory`), for names that are known to be needed soon,
+        so the imports don't hold up the first `get_dependency()`.
+
+        Factories that fail to import are skipped, and raise when they are called.
+
+        :param names: (optional) The names to import the factories of, along with
+                      everything they (transitively) depend on. By default, all of them.
+        :param background: (optional) False to import in the calling thread, rather
+                           than in a new daemon thread.
+        :return: The thread doing the imports (e.g. to `join()`), or None
+        """
+        if names is None:
+            factories = [spec[0] for spec in self._factories.values()]
+        else:
+            for name in names:
+                if name not in self._factories:
+                    raise MissingDependencyException("Missing dependency name: {}".format(name))
+            compact = self._get_graph()
+            nodes = compact.reachable([compact.index[name] for name in names])
+            factories = [self._factories[compact.names[node]][0] for node in nodes]
+        if not background:
+            deferred.preimport(factories)
+            return None
+        thread = threading.Thread(target=deferred.preimport, args=(factories,),
+                                  name='injector-preimport', daemon=True)
+        thread.start()
+        return thread
+
+    def warm_up(self, names=None, executor=None, max_workers=None):
+        """ Constructs dependencies ahead of time, running independent factories in parallel.
+
+        The dependencies are grouped into topological levels, and each level is run
+        on the executor once the level before it has finished, so the time taken
+        follows the longest chain of dependencies rather than the sum of them all.
+
+        :param names: (optional) The names to construct, along with everything they
+                      depend on. Defaults to every dependency in the injector. Async
+                      factories, and whatever depends on them (other than lazily),
+                      are left for `aget_dependency`, and transient values aren't
+                      built ahead of time either.
+        :param executor: (optional) A `concurrent.futures.Executor` to run the
+                         factories on. When using a process pool, the factories and
+                         their values must be picklable, and generator factories,
+                         finalizers and timing aren't supported.
+        :param max_workers: (optional) The number of threads to use when no executor
+                            is given.
+        """
+        if names is None:
+            names = list(self._factories)
+
+        factories = self._factories
+        steps, _ = self._compile_plan(names, prune=True)
+        pending = set()
+        inherited = []
+        # The async values that may not have been built, and the values that need them
+        awaited = set()
+        for step_name, spec, slots in steps:
+            # Lazy and transient values aren't built ahead of time
+            if spec is None or isinstance(_cache_policy(spec), caching.Transient):
+                continue
+            if _options(spec).get('async'):
+                # Unless this injector has it cached already
+                if slots is not None or not self._owns(step_name):
+                    awaited.add(step_name)
+                    continue
+            elif slots is not None and any(
+                    d in awaited for d in spec[1] or () if not isinstance(d, Lazy)):
+                awaited.add(step_name)
+                continue
+            if not self._owns(step_name):
+                inherited.append(step_name)
+            elif self._get_cached(step_name, spec) is MISSING:
+                pending.add(step_name)
+        if inherited:
+            self._parent.warm_up(inherited, executor=executor, max_workers=max_workers)
+        compact = graph.CompactGraph({name: factories[name][1] or () for name in pending})
+
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for level in compact.levels():
+                level = [compact.names[i] for i in level]
+                # Claim the whole level so that other threads wait for these values
+                # instead of building them too. They are claimed in sorted order so
+                # that concurrent warm-ups can't deadlock.
+                level.sort()
+                for name in level:
+                    self._claim(name)
+                try:
+                    futures = []
+                    for name in level:
+                        spec = factories[name]
+                        if self._get_cached(name, spec) is not MISSING:
+                            continue
+                        _check_not_async(name, spec)
+                        args = [self._get_argument(d) for d in spec[1] or ()]
+                        if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+                            # Only the factory itself can be sent to another process
+                            future = executor.submit(spec[0], *args)
+                        else:
+                            future = executor.submit(self._call_factory, name, spec, args)
+                        futures.append((name, spec, future))
+                    for name, spec, future in futures:
+                        self._put_cached(name, spec, future.result())
+                finally:
+                    for name in level:
+                        self._release(name)
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    def _compile_plan(self, roots, prune=False):
+        """ Flattens the transitive dependencies of `roots` into a list of steps.
+
+        Each step is a tuple (name, factory spec, argument slots), where the slots are
+        the indexes of earlier steps whose values are passed to the factory. Steps
+        are in dependency order, so every value is built before it is needed.
+        Lazy dependencies get a step with no spec, which produces a proxy, and their
+        own dependencies aren't included.
+        The graph is walked with an explicit stack so that deep chains of
+        dependencies don't hit the recursion limit.
+
+        When pruning, names that are already cached (or that the parent builds) get a
+        step with no argument slots, and their own dependencies aren't included, so
+        only the part of the graph that has to be built is walked.
+
+        :return: A tuple (steps, the slot of each root)
+        """
+        factories = self._factories
+        cache = self._value_cache
+        slots = {}
+        # Lazy names compare equal to plain names, so their steps are kept separately
+        lazy_slots = {}
+        steps = []
+        in_progress = set()
+        # The roots are treated as the dependencies of a node named None
+        stack = [(None, iter(roots))]
+        while stack:
+            name, remaining = stack[-1]
+            for dependency in remaining:
+                if isinstance(dependency, Lazy):
+                    if dependency not in lazy_slots:
+                        if dependency not in factories:
+                            raise MissingDependencyException(
+                                "Missing dependency name: {}".format(dependency))
+                        lazy_slots[dependency] = len(steps)
+                        steps.append((str(dependency), None, ()))
+                    continue
+                if dependency in slots:
+                    continue
+                if dependency in in_progress:
+                    raise CircularDependencyException(
+                        "Circular dependency on name: {}".format(dependency))
+                if dependency not in factories:
+                    raise MissingDependencyException(
+                        "Missing dependency name: {}".format(dependency))
+                if prune and (dependency in cache or self._is_available(dependency)):
+                    slots[dependency] = len(steps)
+                    steps.append((dependency, factories[dependency], None))
+                    continue
+                in_progress.add(dependency)
+                stack.append((dependency, iter(factories[dependency][1] or ())))
+                break
+            else:
+                stack.pop()
+                if name is None:
+                    continue
+                in_progress.discard(name)
+                spec = factories[name]
+                slots[name] = len(steps)
+                steps.append((name, spec, tuple([
+                    lazy_slots[d] if isinstance(d, Lazy) else slots[d] for d in spec[1] or ()
+                ])))
+        return steps, [
+            lazy_slots[root] if isinstance(root, Lazy) else slots[root] for root in roots
+        ]
+
+    def _is_available(self, name):
+        """ Checks if a value can be had without building it: it is cached, or it is
+        the parent's to build.
+        """
+        if name in self._value_cache or not self._owns(name):
+            return True
+        spec = self._factories[name]
+        return _cache_policy(spec) is not None and self._get_cached(name, spec) is not MISSING
+
+    def _claim(self, name):
+        """ Claims the building of a value for this thread, first waiting for any other
+        thread that has claimed it. Other threads that want the value then wait for it
+        instead of building it too. Only names that are wanted by several threads at
+        once cost more than a dict entry.
+        """
+        ident = threading.get_ident()
+        if self._claims.setdefault(name, ident) != ident:
+            self._wait_to_claim(name, ident)
+
+    def _wait_to_claim(self, name, ident):
+        with self._released:
+            self._waiting += 1
+            try:
+                while self._claims.setdefault(name, ident) != ident:
+                    self._released.wait()
+            finally:
+                self._waiting -= 1
+
+    def _release(self, name):
+        del self._claims[name]
+        # A waiting thread counts itself before checking the claim, so it is either
+        # counted here or sees that the claim is gone
+        if self._waiting:
+            with self._released:
+                self._released.notify_all()
+
+    def _resolve(self, roots):
+        """ Gets the values of some names, building whatever they need that isn't
+        cached yet.
+
+        The graph is walked depth-first with an explicit stack (so that deep chains
+        of dependencies don't hit the recursion limit), stopping at values that are
+        already cached, and each factory is called as soon as its arguments are ready.
+        Values built along the way (including transient ones) are shared by everything
+        in the call that needs them.
+
+        :param roots: A list of names (names wrapped with `lazy()` get a proxy)
+        :return: A list of the values, in the same order
+        """
+        factories = self._factories
+        # The values built by this call, and (when counting metrics) the length of
+        # the longest chain of factories run for each one
+        built = {}
+        depths = {} if self._metrics is not None else None
+        values = []
+        for root in roots:
+            if root not in factories:
+                raise MissingDependencyException("Missing dependency name: {}".format(root))
+            if isinstance(root, Lazy):
+                values.append(LazyProxy(self, str(root)))
+                continue
+            value = built.get(root, MISSING)
+            if value is MISSING:
+                value = self._lookup(root)
+                if value is MISSING:
+                    spec = factories[root]
+                    value = self._build(root, spec, _cache_policy(spec), built, depths)
+            values.append(value)
+        return values
+
+    def _lookup(self, name):
+        """ Gets a value without building it, if it is cached (or it is the parent's to
+        build).
+
+        :return: The value, or MISSING
+        """
+        value = self._value_cache.get(name, MISSING)
+        if value is MISSING:
+            if self._parent is not None and name not in self._local_names:
+                return self._parent.get_dependency(name)
+            policy = _cache_policy(self._factories[name])
+            if policy is None:
+                return MISSING
+            value = self._get_store(policy).get(name)
+            if value is MISSING:
+                return MISSING
+        if self._metrics is not None:
+            self._metrics.count(name, metrics.HITS)
+        return value
+
+    def _build(self, root, spec, policy, built, depths):
+        """ Builds a value that isn't cached, and whatever it needs that isn't either.
+
+        :param root: The name
+        :param spec: Its factory spec
+        :param policy: Its cache policy (None for singletons)
+        :param built: A dict of the values built so far in this call, which the new
+                      values are added to
+        :param depths: A dict of the length of the longest chain of factories run for
+                       each built value, or None when not counting metrics
+        :return: The value
+        """
+        if not spec[1]:
+            value = built[root] = self._construct(
+                root, spec, policy, [], depths,
+                None if self._timings is None else time.perf_counter())
+            if depths is not None and root in depths:
+                self._metrics.record_depth(depths[root])
+            return value
+        factories = self._factories
+        cache = self._value_cache
+        collector = self._metrics
+        parent = self._parent
+        local_names = self._local_names
+        in_progress = {root}
+        # When building each value began, for timing how long it took with its
+        # dependencies
+        started = None if self._timings is None else {root: time.perf_counter()}
+        # Each frame is (name, spec, cache policy, the dependencies not looked at yet,
+        # the values of the ones that have been)
+        stack = [(root, spec, policy, iter(spec[1] or ()), [])]
+        while True:
+            name, spec, policy, remaining, args = stack[-1]
+            for dependency in remaining:
+                if isinstance(dependency, Lazy):
+                    # Factories always get a proxy for lazy dependencies (even if the
+                    # value is cached), so they see the value again if it is replaced
+                    if dependency not in factories:
+                        raise MissingDependencyException(
+                            "Missing dependency name: {}".format(dependency))
+                    args.append(LazyProxy(self, str(dependency)))
+                    continue
+                # Singletons built by this call are cached too, so the cache is looked
+                # at first
+                value = cache.get(dependency, MISSING)
+                if value is not MISSING:
+                    if collector is not None and dependency not in built:
+                        collector.count(dependency, metrics.HITS)
+                else:
+                    value = built.get(dependency, MISSING)
+                    if value is MISSING:
+                        if dependency in in_progress:
+                            raise CircularDependencyException(
+                                "Circular dependency on name: {}".format(dependency))
+                        dependency_spec = factories.get(dependency)
+                        if dependency_spec is None:
+                            raise MissingDependencyException(
+                                "Missing dependency name: {}".format(dependency))
+                        if parent is not None and dependency not in local_names:
+                            value = parent.get_dependency(dependency)
+                        else:
+                            dependency_policy = dependency_spec[2].get('cache') \
+                                if len(dependency_spec) > 2 else None
+                            if dependency_policy is not None:
+                                value = self._get_store(dependency_policy).get(dependency)
+                                if value is not MISSING and collector is not None:
+                                    collector.count(dependency, metrics.HITS)
+                            if value is MISSING and not dependency_spec[1]:
+                                # Without dependencies, it can be built right away
+                                value = built[dependency] = self._construct(
+                                    dependency, dependency_spec, dependency_policy, [],
+                                    depths, None if started is None else time.perf_counter())
+                            elif value is MISSING:
+                                if started is not None:
+                                    started[dependency] = time.perf_counter()
+                                in_progress.add(dependency)
+                                stack.append((dependency, dependency_spec, dependency_policy,
+                                              iter(dependency_spec[1]), []))
+                                break
+                args.append(value)
+            else:
+                stack.pop()
+                in_progress.discard(name)
+                value = built[name] = self._construct(
+                    name, spec, policy, args, depths,
+                    None if started is None else started.pop(name))
+                if not stack:
+                    if depths is not None and root in depths:
+                        # The longest chain of factories run for the root
+                        collector.record_depth(depths[root])
+                    return value
+                stack[-1][4].append(value)
+
+    def _construct(self, name, spec, policy, args, depths, started=None):
+        """ Calls a factory whose arguments are ready, and caches the value. Only one
+        thread runs the factory; the others wait for its claim to be released and then
+        find the value in the cache.
+
+        :param policy: The factory's cache policy (None for singletons)
+        :param started: (optional) When building the value began, when timing
+        :return: The value
+        """
+        store = None if policy is None else self._get_store(policy)
+        if store is not None and not store.single_flight:
+            # Every caller builds its own value, so they don't wait on each other
+            if depths is not None:
+                self._count_miss(name, spec, depths)
+            return self._call_factory(name, spec, args, started)
+        ident = threading.get_ident()
+        if self._claims.setdefault(name, ident) != ident:
+            self._wait_to_claim(name, ident)
+        try:
+            value = self._value_cache.get(name, MISSING) if store is None else store.get(name)
+            if value is not MISSING:
+                if self._metrics is not None:
+                    self._metrics.count(name, metrics.HITS)
+                return value
+            if depths is not None:
+                self._count_miss(name, spec, depths)
+            if self._timings is None and self._metrics is None and \
+                    (len(spec) < 3 or not spec[2]):
+                # Nothing to do but call the factory
+                value = spec[0](*args)
+            else:
+                value = self._call_factory(name, spec, args, started)
+            if store is None:
+                self._value_cache[name] = value
+            else:
+                store.put(name, value)
+            return value
+        finally:
+            self._release(name)
+
+    def _count_miss(self, name, spec, depths):
+        # depths is only given when counting metrics
+        self._metrics.count(name, metrics.MISSES)
+        depths[name] = 1 + max((depths.get(d, 0) for d in spec[1] or ()), default=0)
+
+    def _call_factory(self, name, spec, args, started=None):
+        function = spec[0]
+        options = spec[2] if len(spec) > 2 else _NO_OPTIONS
+        if options:
+            _check_not_async(name, spec)
+            if options.get('generator'):
+                function, args = _start_generator, [function] + list(args)
+        if self._metrics is not None:
+            self._metrics.count(name, metrics.CALLS)
+        try:
+            if self._timings is None:
+                value = function(*args)
+            else:
+                value = self._timings.call(name, function, args, started)
+        except Exception:
+            if self._metrics is not None:
+                self._metrics.count(name, metrics.FAILURES)
+            raise
+        if not options:
+            return value
+        return self._add_finalizer(name, spec, value)
+
+    def _get_store(self, policy):
+        """ Gets this injector's store for a cache policy. """
+        store = self._stores.get(policy)
+        if store is None:
+            with self._lock:
+                store = self._stores.get(policy)
+                if store is None:
+                    store = self._stores[policy] = policy.create_store()
+        return store
+
+    def _get_cached(self, name, spec):
+        policy = _cache_policy(spec)
+        if policy is None:
+            return self._value_cache.get(name, MISSING)
+        return self._get_store(policy).get(name)
+
+    def _put_cached(self, name, spec, value):
+        policy = _cache_policy(spec)
+        if policy is None:
+            self._value_cache[name] = value
+        else:
+            self._get_store(policy).put(name, value)
+
+class BoundFunction(object):
+    """ A function bound to dependencies that have to be fetched for every call,
+    made with `Injector.bind()`. """
+
+    def __init__(self, injector, function, dependencies):
+        self.function = function
+        self._injector = injector
+        self._dependencies = dependencies
+        self._checks_out = not injector._pool_names.isdisjoint(dependencies) #pylint: disable=W0212
+
+    def __call__(self, *args, **kwargs):
+        if self._checks_out:
+            return self._injector._call_with_checkouts( #pylint: disable=W0212
+                self.function, self._dependencies, args, kwargs)
+        get_argument = self._injector._get_argument #pylint: disable=W0212
+        bound = [get_argument(d) for d in self._dependencies]
+        return self.function(*bound, *args, **kwargs)
@@ -2,10 +2,16 @@
 #pylint: disable=C0103
 
 from __future__ import absolute_import
+import asyncio
+import threading
+import time
 import unittest
 
 from injector import exceptions
+from injector.caching import LRU, TTL, Transient
+from injector.caching_test import FakeClock
 from injector.injector import Injector
+from injector.proxy import LazyProxy, lazy
 
 class InjectorTest(unittest.TestCase):
     def setUp(self):
@@ -40,5 +46,467 @@ class InjectorTest(unittest.TestCase):
         result = self.injector.inject(test_fn, ['value1', 'value2'])
         self.assertEqual('1 some string', result)
 
+    def test_get_deep_chain_of_dependencies(self):
+        factories = {'link0': (lambda: 0, None)}
+        for i in range(1, 5000):
+            factories['link{}'.format(i)] = (lambda x: x + 1, ['link{}'.format(i - 1)])
+        injector = Injector(factories)
+        self.assertEqual(4999, injector.get_dependency('link4999'))
+
+    def test_lookups_only_walk_what_is_not_built(self):
+        walked = []
+        class Dependencies(list):
+            def __iter__(self):
+                walked.append(1)
+                return super().__iter__()
+        factories = {'link0': (lambda: 0, None)}
+        for i in range(1, 1000):
+            factories['link{}'.format(i)] = (
+                lambda x: x + 1, Dependencies(['link{}'.format(i - 1)]))
+        injector = Injector(factories)
+        for i in range(1000):
+            self.assertEqual(i, injector.get_dependency('link{}'.format(i)))
+        # Each lookup only looks at the dependencies of the new name
+        self.assertLess(len(walked), 2000)
+
+    def test_lookup_stops_at_cached_values(self):
+        def loader():
+            raise ValueError()
+        injector = Injector({
+            'loader': (loader, None),
+            'config': (lambda l: l, ['loader']),
+            'app': ('app with {}'.format, ['config']),
+        }, overrides={'config': 'config'})
+        self.assertEqual('app with config', injector.get_dependency('app'))
+        self.assertEqual(('app with config',), injector.get_dependencies(['app']))
+
+    def test_constructs_shared_dependency_once(self):
+        calls = []
+        def base():
+            calls.append(1)
+            return 1
+        injector = Injector({
+            'base': (base, None),
+            'left': (lambda b: b + 1, ['base']),
+            'right': (lambda b: b + 2, ['base']),
+            'top': (lambda l, r: l * r, ['left', 'right']),
+        })
+        self.assertEqual(6, injector.get_dependency('top'))
+        self.assertEqual(1, len(calls))
+
+    def test_get_circular_dependency(self):
+        injector = Injector({
+            'a': (lambda b: b, ['b']),
+            'b': (lambda a: a, ['a']),
+        })
+        with self.assertRaises(exceptions.CircularDependencyException):
+            injector.get_dependency('a')
+
+    def test_get_dependency_with_missing_dependency(self):
+        injector = Injector({'a': (lambda b: b, ['b'])})
+        with self.assertRaises(exceptions.MissingDependencyException):
+            injector.get_dependency('a')
+
+    def test_get_dependencies(self):
+        self.assertEqual(
+            (1, 'value1 is 1', 'some string'),
+            self.injector.get_dependencies(['value1', 'factory2', 'value2'])
+        )
+        self.assertEqual((), self.injector.get_dependencies([]))
+
+    def test_get_dependencies_builds_shared_dependencies_once(self):
+        calls = []
+        def base():
+            calls.append(1)
+            return 1
+        injector = Injector({
+            'base': (base, None),
+            'left': (lambda b: b + 1, ['base']),
+            'right': (lambda b: b + 2, ['base']),
+            'cached': (lambda b: b, ['base']),
+        })
+        injector.get_dependency('cached')
+        injector._value_cache.pop('base')
+        self.assertEqual((2, 3, 1), injector.get_dependencies(['left', 'right', 'cached']))
+        self.assertEqual(2, len(calls))
+
+    def test_get_dependencies_missing_dependency(self):
+        with self.assertRaises(exceptions.MissingDependencyException):
+            self.injector.get_dependencies(['value1', 'missing!'])
+
+    def test_warm_up(self):
+        self.injector.warm_up()
+        self.assertEqual('value1 is 1', self.injector._value_cache['factory2'])
+        self.assertEqual(1, self.injector._value_cache['value1'])
+
+    def test_warm_up_runs_independent_factories_in_parallel(self):
+        barrier = threading.Barrier(3, timeout=5)
+        def slow():
+            return barrier.wait() >= 0
+        injector = Injector({
+            'a': (slow, None),
+            'b': (slow, None),
+            'c': (slow, None),
+            'all': (lambda a, b, c: a and b and c, ['a', 'b', 'c']),
+            'unused': (lambda: 1 / 0, None),
+        })
+        injector.warm_up(['all'], max_workers=3)
+        self.assertTrue(injector.get_dependency('all'))
+        self.assertNotIn('unused', injector._value_cache)
+
+class BindTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        def value1():
+            self.calls.append('value1')
+            return 1
+        self.injector = Injector({
+            'value1': (value1, None),
+            'transient': (object, None, {'cache': Transient()}),
+            'broken': (lambda x: x, ['missing']),
+        })
+
+    def test_bind(self):
+        bound = self.injector.bind(lambda a, b: a + b, ['value1'])
+        self.assertEqual(3, bound(2))
+        self.assertEqual(4, bound(b=3))
+        self.assertEqual(['value1'], self.calls)
+
+    def test_bind_without_dependencies(self):
+        self.assertEqual(5, self.injector.bind(lambda x: x, [])(5))
+
+    def test_bind_reuses_singletons(self):
+        bound = self.injector.bind(lambda a: a, ['value1'])
+        bound()
+        self.injector._value_cache.clear()
+        bound()
+        self.assertEqual(['value1'], self.calls)
+
+    def test_bind_resolves_transient_every_call(self):
+        bound = self.injector.bind(lambda t: t, ['transient'])
+        self.assertIsNot(bound(), bound())
+
+    def test_bind_lazy(self):
+        bound = self.injector.bind(lambda a: a, [lazy('value1')])
+        self.assertEqual([], self.calls)
+        self.assertIsInstance(bound(), LazyProxy)
+
+    def test_bind_checks_names(self):
+        with self.assertRaises(exceptions.MissingDependencyException):
+            self.injector.bind(lambda x: x, ['nope'])
+        with self.assertRaises(exceptions.MissingDependencyException):
+            self.injector.bind(lambda x: x, ['broken'])
+
+    def test_bind_many(self):
+        first, second = self.injector.bind_many([
+            (lambda a: a, ['value1']),
+            (lambda a, t: (a, t), ['value1', 'transient']),
+        ])
+        self.assertEqual(1, first())
+        self.assertEqual(1, second()[0])
+        with self.assertRaises(exceptions.MissingDependencyException):
+            self.injector.bind_many([(lambda: 1, []), (lambda x: x, ['nope'])])
+
+class CachePolicyInjectorTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.lru = LRU(1)
+        self.injector = Injector({
+            'transient': (object, None, {'cache': Transient()}),
+            'ttl': (object, None, {'cache': TTL(60, clock=self.clock)}),
+            'tenant-a': (object, None, {'cache': self.lru}),
+            'tenant-b': (object, None, {'cache': self.lru}),
+            'uses-transient': (lambda t: t, ['transient']),
+        })
+
+    def test_transient_is_built_every_time(self):
+        get = self.injector.get_dependency
+        self.assertIsNot(get('transient'), get('transient'))
+        self.assertIs(get('uses-transient'), get('uses-transient'))
+
+    def test_lookup_does_not_rebuild_transient_below_cached_value(self):
+        calls = []
+        def transient():
+            calls.append(1)
+            return len(calls)
+        injector = Injector({
+            't': (transient, None, {'cache': Transient()}),
+            'c': (lambda t: t, ['t']),
+            'y': (lambda c: c, ['c']),
+        })
+        self.assertEqual(1, injector.get_dependency('c'))
+        self.assertEqual(1, injector.get_dependency('y'))
+        self.assertEqual((1, 1), injector.get_dependencies(['y', 'c']))
+        self.assertEqual(1, len(calls))
+
+    def test_ttl_value_is_rebuilt_after_expiring(self):
+        first = self.injector.get_dependency('ttl')
+        self.assertIs(first, self.injector.get_dependency('ttl'))
+        self.clock.now = 60
+        self.assertIsNot(first, self.injector.get_dependency('ttl'))
+
+    def test_lru_bounds_values_across_names(self):
+        first = self.injector.get_dependency('tenant-a')
+        self.assertIs(first, self.injector.get_dependency('tenant-a'))
+        self.injector.get_dependency('tenant-b')
+        self.assertIsNot(first, self.injector.get_dependency('tenant-a'))
+
+    def test_injectors_have_separate_stores(self):
+        other = Injector(self.injector._factories)
+        self.assertIsNot(self.injector.get_dependency('ttl'), other.get_dependency('ttl'))
+
+    def test_warm_up_skips_transient(self):
+        self.injector.warm_up()
+        self.assertNotIn('transient', self.injector._value_cache)
+        self.assertNotIn('ttl', self.injector._value_cache)
+        self.assertIn('uses-transient', self.injector._value_cache)
+
+class TimingInjectorTest(unittest.TestCase):
+    def test_startup_report(self):
+        injector = Injector({
+            'a': (lambda: 1, None),
+            'b': (lambda a: a + 1, ['a']),
+            'unused': (lambda: 1, None),
+        })
+        injector.enable_timing()
+        injector.get_dependency('b')
+
+        report = injector.startup_report()
+        self.assertEqual(['a', 'b'], sorted(report['factories']))
+        self.assertEqual(['a', 'b'], report['critical_path'])
+
+    def test_wall_time_includes_dependencies(self):
+        def slow():
+            time.sleep(0.05)
+            return 1
+        injector = Injector({
+            'slow': (slow, None),
+            'quick': (lambda s: s, ['slow']),
+        })
+        injector.enable_timing()
+        injector.get_dependency('quick')
+
+        factories = injector.startup_report()['factories']
+        self.assertGreaterEqual(factories['quick']['wall_time'], 0.05)
+        self.assertLess(factories['quick']['self_time'], 0.05)
+        self.assertGreaterEqual(factories['slow']['self_time'], 0.05)
+
+    def test_startup_report_without_timing(self):
+        self.assertEqual([], Injector({}).startup_report()['critical_path'])
+
+class MetricsInjectorTest(unittest.TestCase):
+    def test_counts_lookups(self):
+        def broken():
+            raise ValueError()
+        injector = Injector({
+            'config': (lambda: 'config', None),
+            'client': (lambda c: c, ['config']),
+            'request': (lambda c: c, ['client'], {'cache': Transient()}),
+            'broken': (broken, None),
+        })
+        collector = injector.enable_metrics()
+        injector.get_dependency('request')
+        injector.get_dependency('request')
+        injector.inject(lambda c: c, ['client'])
+        with self.assertRaises(ValueError):
+            injector.get_dependency('broken')
+        injector.child().get_dependency('client')
+
+        names = collector.snapshot()['names']
+        # The second lookup of request stops at the cached client
+        self.assertEqual({'hits': 0, 'misses': 1, 'calls': 1, 'failures': 0}, names['config'])
+        self.assertEqual({'hits': 3, 'misses': 1, 'calls': 1, 'failures': 0}, names['client'])
+        self.assertEqual({'hits': 0, 'misses': 2, 'calls': 2, 'failures': 0}, names['request'])
+        self.assertEqual({'hits': 0, 'misses': 1, 'calls': 1, 'failures': 1}, names['broken'])
+        self.assertEqual({1: 1, 3: 1}, collector.snapshot()['resolution_depths'])
+
+    def test_counts_async_lookups(self):
+        async def value():
+            return 1
+        injector = Injector({'a': (value, None, {'async': True})})
+        collector = injector.enable_metrics()
+        async def run():
+            await injector.aget_dependency('a')
+            await injector.aget_dependency('a')
+        asyncio.run(run())
+        self.assertEqual({'hits': 1, 'misses': 1, 'calls': 1, 'failures': 0},
+                         collector.snapshot()['names']['a'])
+
+class ChildInjectorTest(unittest.TestCase):
+    def setUp(self):
+        self.injector = Injector({
+            'config': (object, None),
+            'user': (lambda: 'anonymous', None, {'scope': 'request'}),
+            'greeting': ('hello {}'.format, ['user'], {'scope': 'request'}),
+            'session': (lambda config, user: (config, user), ['config', 'user'],
+                        {'scope': 'request'}),
+        })
+
+    def test_child_shares_singletons(self):
+        child1 = self.injector.child()
+        child2 = self.injector.child()
+        self.assertIs(child1.get_dependency('config'), child2.get_dependency('config'))
+        self.assertIs(self.injector.get_dependency('config'), child1.get_dependency('config'))
+        self.assertIn('config', self.injector._value_cache)
+        self.assertNotIn('config', child1._value_cache)
+
+    def test_child_builds_request_scoped_values(self):
+        child1 = self.injector.child()
+        child2 = self.injector.child()
+        self.assertIsNot(child1.get_dependency('session'), child2.get_dependency('session'))
+        self.assertIs(child1.get_dependency('session'), child1.get_dependency('session'))
+        self.assertNotIn('session', self.injector._value_cache)
+
+    def test_child_overrides(self):
+        child = self.injector.child(overrides={'user': 'alice'})
+        self.assertEqual('hello alice', child.get_dependency('greeting'))
+        self.assertEqual('hello anonymous', self.injector.child().get_dependency('greeting'))
+
+    def test_child_overrides_dependencies_are_not_built(self):
+        def login(config):
+            raise ValueError('no session')
+        injector = Injector({
+            'config': (object, None),
+            'login': (login, ['config'], {'scope': 'request'}),
+            'user': (lambda l: l, ['login'], {'scope': 'request'}),
+            'greeting': ('hello {}'.format, ['user'], {'scope': 'request'}),
+        })
+        child = injector.child(overrides={'user': 'alice'})
+        self.assertEqual('hello alice', child.get_dependency('greeting'))
+        self.assertEqual(('hello alice',), child.get_dependencies(['greeting']))
+        self.assertNotIn('config', injector._value_cache)
+
+    def test_child_overrides_must_exist(self):
+        with self.assertRaises(exceptions.MissingDependencyException):
+            self.injector.child(overrides={'xyz': 1})
+
+    def test_child_with_local_names(self):
+        child = Injector(self.injector._factories, parent=self.injector,
+                         overrides={'user': 'bob'}, local_names=['config'])
+        self.assertIsNot(self.injector.get_dependency('config'), child.get_dependency('config'))
+        self.assertIs(child.get_dependency('config'), child.child().get_dependency('config'))
+        self.assertEqual('hello bob', child.get_dependency('greeting'))
+
+    def test_child_does_not_copy_factories(self):
+        child = self.injector.child()
+        self.assertIs(self.injector._factories, child._factories)
+        self.assertIs(self.injector._request_names, child._request_names)
+
+class LazyInjectorTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        def client():
+            self.calls.append('client')
+            return {'name': 'client'}
+        self.injector = Injector({
+            'client': (client, None),
+            'handler': (lambda c: c, [lazy('client')]),
+            'both': (lambda eager, deferred: (eager, deferred), ['client', lazy('client')]),
+        })
+
+    def test_get_lazy_defers_construction(self):
+        proxy = self.injector.get_lazy('client')
+        self.assertIsInstance(proxy, LazyProxy)
+        self.assertEqual([], self.calls)
+        self.assertEqual(['name'], list(proxy.keys()))
+        self.assertEqual('client', proxy['name'])
+        self.assertEqual(['client'], self.calls)
+
+    def test_get_lazy_returns_cached_value(self):
+        value = self.injector.get_dependency('client')
+        self.assertIs(value, self.injector.get_lazy('client'))
+
+    def test_lazy_dependency(self):
+        proxy = self.injector.get_dependency('handler')
+        self.assertIsInstance(proxy, LazyProxy)
+        self.assertEqual([], self.calls)
+        self.assertIn('name', proxy)
+        self.assertEqual(['client'], self.calls)
+
+    def test_lazy_and_eager_dependency_on_same_name(self):
+        eager, deferred = self.injector.get_dependency('both')
+        self.assertEqual({'name': 'client'}, eager)
+        self.assertEqual('client', deferred['name'])
+        self.assertEqual(['client'], self.calls)
+
+    def test_inject_lazy(self):
+        result = self.injector.inject(lambda c: c, [lazy('client')])
+        self.assertIsInstance(result, LazyProxy)
+        self.assertEqual([], self.calls)
+        self.assertEqual('client', result['name'])
+        self.assertEqual({'name': 'client'}, self.injector.get_dependency('client'))
+        self.assertEqual(['client'], self.calls)
+        self.assertEqual([str], [type(name) for name in self.injector._value_cache])
+
+    def test_get_dependency_with_lazy_name(self):
+        self.assertEqual({'name': 'client'}, self.injector.get_dependency(lazy('client')))
+        self.assertIs(self.injector.get_dependency('client'),
+                      self.injector.get_dependency(lazy('client')))
+
+    def test_get_lazy_missing_dependency(self):
+        with self.assertRaises(exceptions.MissingDependencyException):
+            self.injector.get_lazy('missing!')
+
+class ThreadedInjectorTest(unittest.TestCase):
+    def test_factory_runs_once_across_threads(self):
+        calls = []
+        def slow():
+            calls.append(1)
+            threading.Event().wait(0.05)
+            return object()
+        injector = Injector({'slow': (slow, None)})
+
+        results = []
+        def get():
+            results.append(injector.get_dependency('slow'))
+        threads = [threading.Thread(target=get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(8, len(results))
+        self.assertTrue(all(result is results[0] for result in results))
+        # Nothing is kept per name once the values are built
+        self.assertEqual({}, injector._claims)
+
+    def test_waiting_thread_builds_value_after_factory_fails(self):
+        started = threading.Event()
+        proceed = threading.Event()
+        calls = []
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                started.set()
+                proceed.wait(5)
+                raise ValueError('first call fails')
+            return 'value'
+        injector = Injector({'flaky': (flaky, None)})
+
+        errors = []
+        def get_first():
+            try:
+                injector.get_dependency('flaky')
+            except ValueError as error:
+                errors.append(error)
+        first = threading.Thread(target=get_first)
+        first.start()
+        self.assertTrue(started.wait(5))
+        results = []
+        second = threading.Thread(target=lambda: results.append(injector.get_dependency('flaky')))
+        second.start()
+        deadline = time.monotonic() + 5
+        while injector._waiting == 0 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        proceed.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(1, len(errors))
+        self.assertEqual(['value'], results)
+        self.assertEqual(2, len(calls))
+        self.assertEqual({}, injector._claims)
+
 if __name__ == '__main__':
     unittest.main()
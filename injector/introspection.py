@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+import inspect
+import weakref
+
+from injector.proxy import Lazy
+
+# Maps a callable to the dependency names taken from its signature. Entries go away
+# when the callable does, so introspecting short-lived functions doesn't leak.
+_signature_cache = weakref.WeakKeyDictionary()
+
+_POSITIONAL = (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+
+class Named(str):
+    """ A dependency name given as a parameter's annotation """
+    pass
+
+def named(name):
+    """ Names the dependency for a parameter in its annotation.
+
+    For use when the name isn't a valid parameter name, e.g.
+    `def handler(db: named('db-connection'))`.
+
+    :param name: The name of the dependency
+    :return: The name, marked as a dependency name
+    """
+    return Named(name)
+
+def infer_dependencies(function):
+    """ Works out the names of a function's dependencies from its signature.
+
+    Each positional parameter without a default value is a dependency. It is named
+    by the parameter's annotation if that is a `named()` or `lazy()` name (e.g.
+    `db: named('db-connection')` or `mailer: lazy('mailer')`), and otherwise by the
+    parameter's name, so that type annotations are ignored. With
+    `from __future__ import annotations`, annotations aren't evaluated, so the
+    parameter's name is always used.
+
+    The result is cached for each callable, so this is only slow the first time.
+
+    :param function: A function, method or class
+    :return: A list of dependency names
+    """
+    # Bound methods are made afresh on each attribute access, so cache their function
+    skip = 0
+    key = function
+    if inspect.ismethod(function):
+        key = function.__func__
+        skip = 1
+
+    try:
+        names = _signature_cache.get(key)
+    except TypeError:
+        return _dependency_names(function)
+    if names is None:
+        names = _dependency_names(key)
+        try:
+            _signature_cache[key] = names
+        except TypeError:
+            pass
+    return list(names[skip:])
+
+def _dependency_names(function):
+    try:
+        signature = inspect.signature(function)
+    except (TypeError, ValueError):
+        # Some builtins don't have a signature
+        return ()
+    return tuple(
+        parameter.annotation if isinstance(parameter.annotation, (Named, Lazy))
+        else parameter.name
+        for parameter in signature.parameters.values()
+        if parameter.kind in _POSITIONAL and parameter.default is parameter.empty
+    )
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+#pylint: disable=C0103
+
+from __future__ import absolute_import
+import gc
+import unittest
+import weakref
+
+from injector import introspection
+from injector.introspection import Named, infer_dependencies, named
+from injector.proxy import Lazy, lazy
+
+class Service(object):
+    def __init__(self, db, cache=None):
+        self.db = db
+        self.cache = cache
+
+    def handle(self, request, user: named('current-user')):
+        return request, user
+
+class InferDependenciesTest(unittest.TestCase):
+    def test_function(self):
+        def handler(db, cache, retries=3, *args, timeout, **kwargs):
+            return db, cache, retries, args, timeout, kwargs
+        self.assertEqual(['db', 'cache'], infer_dependencies(handler))
+
+    def test_annotations(self):
+        def handler(db: named('db-connection'), mailer: lazy('mailer'), count: int):
+            return db, mailer, count
+        names = infer_dependencies(handler)
+        self.assertEqual(['db-connection', 'mailer', 'count'], names)
+        self.assertIsInstance(names[0], Named)
+        self.assertIsInstance(names[1], Lazy)
+
+    def test_ignores_string_annotations(self):
+        # As with `from __future__ import annotations`, where every annotation is a string
+        def handler(db: 'Database', count: 'int', mailer: "lazy('mailer')"):
+            return db, count, mailer
+        self.assertEqual(['db', 'count', 'mailer'], infer_dependencies(handler))
+
+    def test_class(self):
+        self.assertEqual(['db'], infer_dependencies(Service))
+
+    def test_bound_method(self):
+        service = Service(None)
+        self.assertEqual(['request', 'current-user'], infer_dependencies(service.handle))
+        self.assertEqual(['self', 'request', 'current-user'], infer_dependencies(Service.handle))
+
+    def test_no_signature(self):
+        self.assertEqual([], infer_dependencies('{}'.format))
+        self.assertEqual([], infer_dependencies(dict))
+
+    def test_caches_without_leaking(self):
+        def handler(db):
+            return db
+        self.assertEqual(['db'], infer_dependencies(handler))
+        self.assertIn(handler, introspection._signature_cache)
+
+        reference = weakref.ref(handler)
+        del handler
+        gc.collect()
+        # The cache neither keeps the function alive nor keeps an entry for it
+        self.assertIsNone(reference())
+        self.assertTrue(all(key() is not None
+                            for key in introspection._signature_cache.keyrefs()))
+
+if __name__ == '__main__':
+    unittest.main()
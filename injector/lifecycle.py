@@ -0,0 +1,383 @@
+from __future__ import absolute_import
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import os
+import threading
+import weakref
+
+from injector import graph, metrics
+from injector.caching import MISSING
+from injector.proxy import Lazy, LazyProxy
+from injector.exceptions import AsyncDependencyException
+from injector.exceptions import MissingDependencyException
+from injector.exceptions import PoolException
+
+_NO_OPTIONS = {}
+
+def _options(spec):
+    return spec[2] if len(spec) > 2 else _NO_OPTIONS
+
+def _cache_policy(spec):
+    return _options(spec).get('cache')
+
+def _start_generator(function, *args):
+    generator = function(*args)
+    return next(generator), generator
+
+async def _start_async_generator(function, *args):
+    generator = function(*args)
+    return await generator.__anext__(), generator
+
+async def _finish_async_generator(generator):
+    try:
+        await generator.__anext__()
+    except StopAsyncIteration:
+        pass
+
+# Injectors that have fork-unsafe factories, to reset in forked child processes
+_fork_aware_injectors = weakref.WeakSet()
+# The finalizers of values dropped after forking. They belong to the parent process,
+# so they are never run here, but are kept so that collecting them doesn't resume a
+# generator's teardown either.
+_parent_finalizers = []
+
+def _after_fork_in_child():
+    for injector in list(_fork_aware_injectors):
+        injector.after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+class LifecycleMixin(object):
+    """ The parts of `injector.Injector` that deal with more than building values:
+    building them asynchronously, checking them out of pools, tearing them down, and
+    resetting them after forking.
+
+    These need the rest of `Injector`, so this isn't meant to be used on its own.
+    """
+
+    async def aget_dependency(self, name):
+        """ Get the value of a dependency, awaiting any async factories.
+
+        The dependencies of a factory are fetched concurrently, and concurrent calls
+        for the same name share a single construction of the value.
+
+        :param name: The name of the dependency
+        :return: the value of the dependency
+        """
+        value = self._value_cache.get(name, MISSING)
+        if value is not MISSING:
+            if self._metrics is not None:
+                self._metrics.count(name, metrics.HITS)
+            return value
+        name = str(name)
+        if not self._owns(name):
+            return await self._parent.aget_dependency(name)
+        task = self._tasks.get(name)
+        if task is None:
+            self._check_resolvable(name)
+            value = self._get_cached(name, self._factories[name])
+            if self._metrics is not None:
+                self._metrics.count(name, metrics.HITS if value is not MISSING else metrics.MISSES)
+            if value is not MISSING:
+                return value
+            task = self._tasks[name] = asyncio.ensure_future(self._aconstruct(name))
+        return await asyncio.shield(task)
+
+    async def _aconstruct(self, name):
+        try:
+            spec = self._factories[name]
+            args = await asyncio.gather(*[
+                self._aget_argument(d) for d in spec[1] or ()
+            ])
+            options = _options(spec)
+            function, args, is_async = spec[0], list(args), options.get('async')
+            if options.get('generator'):
+                args = [function] + args
+                function = _start_async_generator if is_async else _start_generator
+            if self._metrics is not None:
+                self._metrics.count(name, metrics.CALLS)
+            try:
+                if self._timings is None:
+                    value = function(*args)
+                    if is_async:
+                        value = await value
+                else:
+                    value = await self._timings.acall(name, function, args, is_async)
+            except Exception:
+                if self._metrics is not None:
+                    self._metrics.count(name, metrics.FAILURES)
+                raise
+            value = self._add_finalizer(name, spec, value)
+            self._put_cached(name, spec, value)
+            return value
+        finally:
+            del self._tasks[name]
+
+    async def _aget_argument(self, dependency):
+        if isinstance(dependency, Lazy):
+            return LazyProxy(self, str(dependency))
+        return await self.aget_dependency(dependency)
+
+    def _check_resolvable(self, name):
+        """ Checks that a name can be built (none of what it needs is missing, and there
+        are no cycles), before the async path builds it one factory at a time.
+
+        The names that had to be walked are remembered, so that looking up their
+        dependencies afterwards doesn't walk the same part of the graph again.
+        """
+        if name not in self._checked:
+            steps, _ = self._compile_plan([name], prune=True)
+            self._checked.update(
+                step_name for step_name, spec, arg_slots in steps
+                if spec is not None and arg_slots is not None
+            )
+
+    @contextlib.contextmanager
+    def checkout(self, name):
+        """ Takes an instance from a pool (see `Dependencies.register_pool`) for the
+        length of a `with` block, and gives it back afterwards.
+
+        Instances are built when needed, up to the pool's size. When they are all in
+        use, this waits for one to be given back (or raises `PoolException` once the
+        pool's timeout runs out).
+
+        :param name: The name of the pool
+        :return: A context manager giving the instance
+        """
+        if name not in self._pool_names:
+            if name not in self._factories:
+                raise MissingDependencyException("Missing dependency name: {}".format(name))
+            raise PoolException("Not a pool: {}".format(name))
+        pool = self.get_dependency(name)
+        instance = pool.acquire()
+        try:
+            yield instance
+        finally:
+            pool.release(instance)
+
+    def pool_stats(self):
+        """ Describes how much each pool that has been used is being used.
+
+        :return: A dict of {name: stats}, with the stats described in `Pool.stats()`
+        """
+        root = self
+        while root._parent is not None: #pylint: disable=W0212
+            root = root._parent #pylint: disable=W0212
+        return {
+            name: root._value_cache[name].stats() #pylint: disable=W0212
+            for name in self._pool_names if name in root._value_cache #pylint: disable=W0212
+        }
+
+    def _call_with_checkouts(self, function, dependencies, args, kwargs):
+        """ Calls a function with the values of its dependencies, with an instance checked
+        out of each pool it (eagerly) depends on until it returns.
+        """
+        with contextlib.ExitStack() as stack:
+            values = [
+                stack.enter_context(self.checkout(d))
+                if d in self._pool_names and not isinstance(d, Lazy)
+                else self._get_argument(d)
+                for d in dependencies
+            ]
+            return function(*values, *args, **kwargs)
+
+    def close(self, max_workers=None):
+        """ Tear down the values that were built, and empty the cache.
+
+        Values are torn down in reverse dependency order, so a value is torn down
+        before anything it depends on. Finalizers at the same level run in parallel on
+        a thread pool. The values that get torn down are the singletons from factories
+        that are generator functions (which are resumed after their `yield`) or that
+        were registered with a finalizer. Child injectors must be closed separately.
+
+        :param max_workers: (optional) The number of threads to run finalizers on
+        :raises AsyncDependencyException: if there are async finalizers (use `aclose()`)
+        """
+        if any(is_async for _, is_async in self._finalizers.values()):
+            raise AsyncDependencyException("Async finalizers must be run with aclose")
+        levels = self._teardown_levels()
+        errors = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for level in levels:
+                futures = [executor.submit(finalizer) for finalizer, _ in level]
+                errors.extend(f.exception() for f in futures if f.exception() is not None)
+        if errors:
+            raise errors[0]
+
+    async def aclose(self):
+        """ Like `close()`, but also runs async finalizers. Finalizers at the same level
+        run concurrently (sync ones on the event loop's default executor).
+        """
+        await self._ateardown(self._teardown_levels())
+
+    async def _ateardown(self, levels):
+        loop = asyncio.get_running_loop()
+        errors = []
+        for level in levels:
+            results = await asyncio.gather(*[
+                finalizer() if is_async else loop.run_in_executor(None, finalizer)
+                for finalizer, is_async in level
+            ], return_exceptions=True)
+            errors.extend(r for r in results if isinstance(r, BaseException))
+        if errors:
+            raise errors[0]
+
+    def invalidate(self, name):
+        """ Drop the value of a dependency, and of everything that (transitively) depends
+        on it, so they are built again the next time they are used.
+
+        Everything else stays cached. Dropped values are torn down like in `close()`,
+        except that their finalizers run one at a time on this thread. Only this
+        injector's values are dropped (existing child injectors keep theirs), and
+        values already bound with `bind()` are not updated.
+
+        :param name: The name of the dependency
+        :raises AsyncDependencyException: if a dropped value has an async finalizer
+                                          (use `ainvalidate()`)
+        """
+        names = self._invalidated_names(name)
+        if any(self._finalizers[n][1] for n in names if n in self._finalizers):
+            raise AsyncDependencyException("Async finalizers must be run with ainvalidate")
+        errors = []
+        for level in self._teardown_levels(names):
+            for finalizer, _ in level:
+                try:
+                    finalizer()
+                except Exception as error: #pylint: disable=W0703
+                    errors.append(error)
+        if errors:
+            raise errors[0]
+
+    async def ainvalidate(self, name):
+        """ Like `invalidate()`, but also runs async finalizers (and runs the finalizers
+        at the same level concurrently, like `aclose()`).
+
+        :param name: The name of the dependency
+        """
+        await self._ateardown(self._teardown_levels(self._invalidated_names(name)))
+
+    def replace_value(self, name, value):
+        """ Use a new value for a dependency from now on, e.g. when a setting changes.
+
+        Everything that (transitively) depends on it is dropped, as with `invalidate()`,
+        and rebuilt with the new value when it is next used. The new value isn't torn
+        down by `close()`.
+
+        :param name: The name of the dependency
+        :param value: The new value
+        """
+        self.invalidate(name)
+        self._value_cache[name] = value
+
+    def _invalidated_names(self, name):
+        if name not in self._factories:
+            raise MissingDependencyException("Missing dependency name: {}".format(name))
+        compact = self._get_graph()
+        node = compact.index[name]
+        return [name] + [compact.names[i] for i in compact.closure(node, reverse=True)
+                         if i != node]
+
+    def _teardown_levels(self, names=None):
+        """ Takes the finalizers and removes the values from the cache.
+
+        :param names: (optional) The names to remove (by default, everything)
+        :return: A list of lists of (finalizer, is_async) tuples, in the order to run them
+        """
+        if names is None:
+            finalizers = self._finalizers
+            cache = self._value_cache
+            self._finalizers = {}
+            self._value_cache = {}
+        else:
+            finalizers = {}
+            cache = {}
+            for name in names:
+                # Wait for a value that is being built, so that it is dropped too
+                self._claim(name)
+                try:
+                    if name in self._finalizers:
+                        finalizers[name] = self._finalizers.pop(name)
+                    if name in self._value_cache:
+                        cache[name] = self._value_cache.pop(name)
+                    policy = _cache_policy(self._factories[name])
+                    if policy is not None:
+                        self._get_store(policy).evict(name)
+                finally:
+                    self._release(name)
+        compact = graph.CompactGraph({name: self._factories[name][1] or () for name in cache})
+        levels = []
+        for level in reversed(compact.levels()):
+            level = [finalizers[name] for name in map(compact.names.__getitem__, level)
+                     if name in finalizers]
+            if level:
+                levels.append(level)
+        return levels
+
+    def _add_finalizer(self, name, spec, value):
+        """ Remembers how to tear down a new singleton value.
+
+        For generator factories, `value` is a tuple of the value and the generator.
+
+        :return: The value
+        """
+        options = _options(spec)
+        if options.get('generator'):
+            value, generator = value
+            if options.get('async'):
+                finalizer = (functools.partial(_finish_async_generator, generator), True)
+            else:
+                finalizer = (functools.partial(next, generator, None), False)
+        elif options.get('finalizer') is not None:
+            function = options['finalizer']
+            finalizer = (functools.partial(function, value), asyncio.iscoroutinefunction(function))
+        else:
+            return value
+        # Only singletons are torn down, since the injector doesn't keep track of the
+        # other values
+        if _cache_policy(spec) is None:
+            self._finalizers[name] = finalizer
+        return value
+
+    def prepare_fork(self):
+        """ Work out ahead of time which values a forked child process has to rebuild.
+
+        These are the values of factories registered with fork_safe=False, and of
+        everything that depends on them (except through lazy proxies). Where
+        `os.register_at_fork` exists, `after_fork()` is called automatically in the
+        child; calling this before forking just saves the child that work.
+
+        :return: A frozenset of the names that will be dropped
+        """
+        if self._fork_unsafe is None:
+            compact = self._get_graph()
+            unsafe = [compact.index[name] for name in self._fork_unsafe_names]
+            closure = [compact.names[i] for i in compact.reachable(unsafe, reverse=True)]
+            self._fork_unsafe = frozenset(closure)
+        _fork_aware_injectors.add(self)
+        return self._fork_unsafe
+
+    def after_fork(self):
+        """ Drop the values that aren't safe to use in a forked child process.
+
+        Other singletons stay cached (and shared copy-on-write with the parent), and the
+        dropped values are rebuilt the next time they are used. Values kept by TTL and
+        LRU cache policies are all dropped, since another thread may have held their
+        locks when the process forked. Overrides are kept, and values already bound with
+        `bind()` are not updated. The dropped values are left for the parent process to
+        tear down, so `close()` in the child doesn't run their finalizers.
+        """
+        self._claims = {}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._waiting = 0
+        self._tasks = {}
+        self._stores = {}
+        for name in self.prepare_fork():
+            if name not in self._overrides:
+                self._value_cache.pop(name, None)
+                finalizer = self._finalizers.pop(name, None)
+                if finalizer is not None:
+                    _parent_finalizers.append(finalizer)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+#pylint: disable=C0103
+
+from __future__ import absolute_import
+import asyncio
+import gc
+import os
+import unittest
+
+from injector import exceptions
+from injector.caching import TTL
+from injector.caching_test import FakeClock
+from injector.injector import Injector
+from injector.pooling import Pool
+from injector.proxy import lazy
+
+class AsyncInjectorTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.both_started = asyncio.Event()
+        async def slow(name):
+            self.calls.append(name)
+            if len(self.calls) == 2:
+                self.both_started.set()
+            await asyncio.wait_for(self.both_started.wait(), 5)
+            return name
+        self.injector = Injector({
+            'a': (slow, ['name-a'], {'async': True}),
+            'b': (slow, ['name-b'], {'async': True}),
+            'name-a': (lambda: 'a', None),
+            'name-b': (lambda: 'b', None),
+            'both': ('{} {}'.format, ['a', 'b']),
+        })
+
+    def test_aget_dependency_awaits_dependencies_concurrently(self):
+        result = asyncio.run(self.injector.aget_dependency('both'))
+        self.assertEqual('a b', result)
+        self.assertEqual('a b', self.injector.get_dependency('both'))
+
+    def test_concurrent_awaiters_share_construction(self):
+        async def get_twice():
+            return await asyncio.gather(
+                self.injector.aget_dependency('both'),
+                self.injector.aget_dependency('both'),
+            )
+        self.assertEqual(['a b', 'a b'], asyncio.run(get_twice()))
+        self.assertEqual(['a', 'b'], sorted(self.calls))
+
+    def test_get_dependency_rejects_async_factory(self):
+        with self.assertRaises(exceptions.AsyncDependencyException):
+            self.injector.get_dependency('both')
+
+    def test_warm_up_skips_async_factories(self):
+        self.injector.warm_up()
+        self.assertEqual({'name-a', 'name-b'}, set(self.injector._value_cache))
+        self.assertEqual([], self.calls)
+
+        self.assertEqual('a b', asyncio.run(self.injector.aget_dependency('both')))
+        self.injector.invalidate('both')
+        self.injector.warm_up()
+        self.assertIn('both', self.injector._value_cache)
+
+    def test_aget_missing_dependency(self):
+        with self.assertRaises(exceptions.MissingDependencyException):
+            asyncio.run(self.injector.aget_dependency('missing!'))
+
+class PoolInjectorTest(unittest.TestCase):
+    def setUp(self):
+        self.closed = []
+        self.injector = Injector({
+            'dsn': (lambda: 'db://', None),
+            'db': (lambda dsn: Pool(lambda: [dsn], 2, finalizer=self.closed.append),
+                   ['dsn'], {'pool': True, 'finalizer': Pool.close}),
+            'plain': (lambda: 'plain', None),
+        })
+
+    def test_checkout(self):
+        with self.injector.checkout('db') as first:
+            with self.injector.checkout('db') as second:
+                self.assertEqual(['db://'], first)
+                self.assertIsNot(first, second)
+                self.assertEqual(2, self.injector.pool_stats()['db']['in_use'])
+        self.assertEqual(0, self.injector.pool_stats()['db']['in_use'])
+
+    def test_checkout_rejects_other_names(self):
+        with self.assertRaises(exceptions.PoolException):
+            with self.injector.checkout('plain'):
+                pass
+
+    def test_inject_checks_out_instances(self):
+        def handler(connection, plain):
+            self.assertEqual(1, self.injector.pool_stats()['db']['in_use'])
+            return connection
+        self.assertEqual(['db://'], self.injector.inject(handler, ['db', 'plain']))
+        self.assertEqual(0, self.injector.pool_stats()['db']['in_use'])
+
+    def test_bind_checks_out_instances_per_call(self):
+        bound = self.injector.bind(lambda c, n: (c, n), ['db'])
+        self.assertEqual((['db://'], 1), bound(1))
+        self.assertEqual(1, self.injector.pool_stats()['db']['idle'])
+
+    def test_close_drops_instances(self):
+        with self.injector.child().checkout('db') as connection:
+            pass
+        self.injector.close()
+        self.assertEqual([connection], self.closed)
+
+class CloseInjectorTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        def pool():
+            self.events.append('open pool')
+            yield 'pool'
+            self.events.append('close pool')
+        self.injector = Injector({
+            'pool': (pool, None, {'generator': True}),
+            'cache': (lambda: 'cache', None, {'finalizer': self.events.append}),
+            'plain': (lambda p: p, ['pool']),
+            'client': (lambda p, c: 'client', ['plain', 'cache'],
+                       {'finalizer': lambda c: self.events.append('close ' + c)}),
+        })
+
+    def test_close_tears_down_in_reverse_order(self):
+        self.assertEqual('client', self.injector.get_dependency('client'))
+        self.assertEqual('pool', self.injector.get_dependency('pool'))
+        self.injector.close()
+
+        self.assertEqual('open pool', self.events[0])
+        self.assertEqual('close client', self.events[1])
+        self.assertEqual(set(['close pool', 'cache']), set(self.events[2:]))
+        self.assertEqual({}, self.injector._value_cache)
+
+    def test_close_only_tears_down_built_values(self):
+        self.injector.get_dependency('cache')
+        self.injector.close()
+        self.assertEqual(['cache'], self.events)
+
+    def test_close_raises_finalizer_errors(self):
+        injector = Injector({
+            'a': (object, None, {'finalizer': lambda a: 1 / 0}),
+            'b': (object, None, {'finalizer': self.events.append}),
+        })
+        injector.get_dependencies(['a', 'b'])
+        with self.assertRaises(ZeroDivisionError):
+            injector.close()
+        self.assertEqual(1, len(self.events))
+
+    def test_aclose(self):
+        async def connection():
+            self.events.append('open connection')
+            yield 'connection'
+            self.events.append('close connection')
+        async def release(value):
+            self.events.append('release ' + value)
+        injector = Injector({
+            'connection': (connection, None, {'async': True, 'generator': True}),
+            'session': (lambda c: 'session', ['connection'], {'finalizer': release}),
+        })
+        async def run():
+            self.assertEqual('session', await injector.aget_dependency('session'))
+            with self.assertRaises(exceptions.AsyncDependencyException):
+                injector.close()
+            await injector.aclose()
+        asyncio.run(run())
+        self.assertEqual(
+            ['open connection', 'release session', 'close connection'], self.events)
+
+class InvalidateInjectorTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.built = []
+        def build(name, value):
+            self.built.append(name)
+            return value
+        self.injector = Injector({
+            'flag': (lambda: build('flag', False), None),
+            'pool': (lambda: build('pool', 'pool'), None,
+                     {'finalizer': lambda p: self.events.append('close pool')}),
+            'feature': (lambda f: build('feature', 'on' if f else 'off'), ['flag'],
+                        {'finalizer': lambda f: self.events.append('close feature')}),
+            'handler': (lambda f, p: build('handler', (f, p)), ['feature', 'pool']),
+            'report': (lambda f: build('report', f), [lazy('feature')]),
+        })
+        self.injector.get_dependencies(['handler', 'report'])
+        del self.built[:]
+
+    def test_invalidate_drops_only_dependents(self):
+        self.injector.invalidate('feature')
+        self.assertEqual(['close feature'], self.events)
+        self.assertEqual(set(['flag', 'pool', 'report']), set(self.injector._value_cache))
+
+        self.assertEqual(('off', 'pool'), self.injector.get_dependency('handler'))
+        self.assertEqual(['feature', 'handler'], self.built)
+
+    def test_replace_value(self):
+        self.injector.replace_value('flag', True)
+        self.assertEqual(('on', 'pool'), self.injector.get_dependency('handler'))
+        self.assertEqual(['feature', 'handler'], self.built)
+        self.assertTrue(self.injector.get_dependency('flag'))
+        self.assertEqual('on', self.injector.get_dependency('report').upper().lower())
+
+    def test_replace_value_with_dependencies(self):
+        def loader():
+            raise ValueError('config file is gone')
+        injector = Injector({
+            'loader': (loader, None),
+            'config': (lambda l: l, ['loader']),
+            'app': ('app with {}'.format, ['config']),
+        })
+        injector.replace_value('config', 'new config')
+        self.assertEqual('app with new config', injector.get_dependency('app'))
+        injector.invalidate('app')
+        self.assertEqual(('app with new config',), injector.get_dependencies(['app']))
+        injector.invalidate('app')
+        self.assertEqual('app with new config',
+                         asyncio.run(injector.aget_dependency('app')))
+
+    def test_invalidate_evicts_from_stores(self):
+        clock = FakeClock()
+        injector = Injector({'a': (object, None, {'cache': TTL(60, clock=clock)})})
+        first = injector.get_dependency('a')
+        injector.invalidate('a')
+        self.assertIsNot(first, injector.get_dependency('a'))
+
+    def test_invalidate_missing_dependency(self):
+        with self.assertRaises(exceptions.MissingDependencyException):
+            self.injector.invalidate('nope')
+
+    def test_ainvalidate(self):
+        async def close(value):
+            self.events.append('close ' + value)
+        injector = Injector({'a': (lambda: 'a', None, {'finalizer': close})})
+        injector.get_dependency('a')
+        with self.assertRaises(exceptions.AsyncDependencyException):
+            injector.invalidate('a')
+        asyncio.run(injector.ainvalidate('a'))
+        self.assertEqual(['close a'], self.events)
+        self.assertEqual({}, injector._value_cache)
+
+class ForkInjectorTest(unittest.TestCase):
+    def setUp(self):
+        self.injector = Injector({
+            'config': (object, None),
+            'socket': (object, None, {'fork_safe': False}),
+            'client': (lambda c, s: (c, s), ['config', 'socket']),
+            'handler': (lambda c: c, ['client']),
+            'lazy-handler': (lambda s: s, [lazy('socket')]),
+        })
+
+    def test_prepare_fork(self):
+        self.assertEqual(
+            frozenset(['socket', 'client', 'handler']),
+            self.injector.prepare_fork()
+        )
+
+    def test_after_fork_drops_unsafe_values(self):
+        config = self.injector.get_dependency('config')
+        socket = self.injector.get_dependency('socket')
+        handler = self.injector.get_dependency('handler')
+        self.injector.get_dependency('lazy-handler')
+
+        self.injector.after_fork()
+
+        self.assertEqual(set(['config', 'lazy-handler']), set(self.injector._value_cache))
+        self.assertIs(config, self.injector.get_dependency('config'))
+        self.assertIsNot(socket, self.injector.get_dependency('socket'))
+        self.assertIsNot(handler, self.injector.get_dependency('handler'))
+
+    def test_after_fork_keeps_overrides(self):
+        child = Injector(self.injector._factories, parent=self.injector,
+                         overrides={'client': 'fake client'}, local_names=['client', 'handler'])
+        self.assertEqual('fake client', child.get_dependency('handler'))
+        child.after_fork()
+        self.assertEqual({'client': 'fake client'}, child._value_cache)
+        self.assertEqual('fake client', child.get_dependency('handler'))
+
+    def _connection_injector(self, events):
+        def connection():
+            pid = os.getpid()
+            events.append('open {}'.format(pid))
+            try:
+                yield pid
+            finally:
+                events.append('close {}'.format(pid))
+        return Injector({
+            'connection': (connection, None, {'generator': True, 'fork_safe': False}),
+        })
+
+    def test_after_fork_leaves_teardown_to_the_parent(self):
+        events = []
+        injector = self._connection_injector(events)
+        injector.get_dependency('connection')
+        injector.after_fork()
+        injector.get_dependency('connection')
+        gc.collect()
+        injector.close()
+        pid = os.getpid()
+        self.assertEqual(['open {}'.format(pid)] * 2 + ['close {}'.format(pid)], events)
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'needs os.register_at_fork')
+    def test_forked_child_doesnt_tear_down_parent_values(self):
+        events = []
+        injector = self._connection_injector(events)
+        parent = injector.get_dependency('connection')
+        pid = os.fork()
+        if pid == 0:
+            ok = injector.get_dependency('connection') == os.getpid()
+            gc.collect()
+            injector.close()
+            ok = ok and 'close {}'.format(parent) not in events
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertEqual(['open {}'.format(parent)], events)
+        injector.close()
+        self.assertEqual('close {}'.format(parent), events[-1])
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'needs os.register_at_fork')
+    def test_drops_unsafe_values_in_forked_child(self):
+        self.injector.get_dependency('handler')
+        pid = os.fork()
+        if pid == 0:
+            ok = 'config' in self.injector._value_cache and \
+                'socket' not in self.injector._value_cache
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertIn('socket', self.injector._value_cache)
+
+if __name__ == '__main__':
+    unittest.main()
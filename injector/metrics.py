@@ -0,0 +1,153 @@
+from __future__ import absolute_import
+import threading
+import weakref
+
+# Indexes of the counters kept for each name
+HITS = 0
+MISSES = 1
+CALLS = 2
+FAILURES = 3
+
+_COUNTERS = ('hits', 'misses', 'calls', 'failures')
+
+_HELP = {
+    'hits': 'Lookups that found a cached value.',
+    'misses': 'Lookups that had to build the value.',
+    'calls': 'Factory invocations.',
+    'failures': 'Factory invocations that raised an exception.',
+}
+
+class _ThreadCounts(object):
+    # Kept in a thread-local, so it goes away when its thread exits
+    __slots__ = ('counts', 'depths', '__weakref__')
+
+    def __init__(self):
+        self.counts = {}
+        self.depths = {}
+
+def _add_counts(names, depths, thread_counts, thread_depths):
+    for name, values in list(thread_counts.items()):
+        totals = names.get(name)
+        if totals is None:
+            totals = names[name] = [0, 0, 0, 0]
+        for counter, value in enumerate(list(values)):
+            totals[counter] += value
+    for depth, number in list(thread_depths.items()):
+        depths[depth] = depths.get(depth, 0) + number
+
+def _retire(lock, threads, totals, key, thread_counts, thread_depths):
+    # Called when a thread's counts go away with it
+    with lock:
+        del threads[key]
+        _add_counts(totals[0], totals[1], thread_counts, thread_depths)
+
+class Metrics(object):
+    """ Counts how dependencies are looked up and built.
+
+    Each thread counts into its own dicts, so counting doesn't take a lock; the
+    counts are only added up by `snapshot()`. When a thread exits, its counts are
+    added to the totals of the threads that have gone, so they don't pile up.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # The (counts, depths) of each thread that is counting, by the id of its
+        # _ThreadCounts
+        self._threads = {}
+        # The (counts, depths) of the threads that have exited
+        self._totals = ({}, {})
+
+    def _thread_counts(self):
+        counts = getattr(self._local, 'counts', None)
+        if counts is None:
+            counts = self._local.counts = _ThreadCounts()
+            key = id(counts)
+            with self._lock:
+                self._threads[key] = (counts.counts, counts.depths)
+            # The finalizer only holds the dicts, so the Metrics can still go away
+            finalizer = weakref.finalize(counts, _retire, self._lock, self._threads,
+                                         self._totals, key, counts.counts, counts.depths)
+            finalizer.atexit = False
+        return counts
+
+    def count(self, name, counter):
+        """ Adds one to a counter for a name.
+
+        :param name: The name of the dependency
+        :param counter: One of HITS, MISSES, CALLS or FAILURES
+        """
+        counts = self._thread_counts().counts
+        values = counts.get(name)
+        if values is None:
+            values = counts[name] = [0, 0, 0, 0]
+        values[counter] += 1
+
+    def record_depth(self, depth):
+        """ Records the depth of a resolution: the longest chain of factories that had to
+        run, one inside the other, to build a value.
+
+        :param depth: An int (at least 1)
+        """
+        depths = self._thread_counts().depths
+        depths[depth] = depths.get(depth, 0) + 1
+
+    def snapshot(self):
+        """ Adds up the counts from every thread.
+
+        :return: A dict with the keys 'names' (a dict of {name: {'hits', 'misses',
+                 'calls', 'failures'}}) and 'resolution_depths' (a dict of {depth:
+                 number of resolutions}).
+        """
+        counts = {}
+        depths = {}
+        with self._lock:
+            _add_counts(counts, depths, *self._totals)
+            for thread_counts, thread_depths in self._threads.values():
+                _add_counts(counts, depths, thread_counts, thread_depths)
+        names = {name: dict(zip(_COUNTERS, values)) for name, values in counts.items()}
+        return {'names': names, 'resolution_depths': depths}
+
+    def prometheus_text(self, prefix='injector'):
+        """ Formats a snapshot in the Prometheus text exposition format, e.g. to serve
+        from a /metrics endpoint.
+
+        :param prefix: (optional) The prefix of the metric names
+        :return: A string
+        """
+        return prometheus_text(self.snapshot(), prefix)
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_text(snapshot, prefix='injector'):
+    """ Formats the result of `Metrics.snapshot()` in the Prometheus text format.
+
+    The counters are labelled with the dependency name, and the resolution depths
+    are a histogram with a bucket for each depth seen.
+
+    :param snapshot: A dict, as returned by `Metrics.snapshot()`
+    :param prefix: (optional) The prefix of the metric names
+    :return: A string
+    """
+    lines = []
+    names = sorted(snapshot['names'].items())
+    for counter in _COUNTERS:
+        metric = '{}_{}_total'.format(prefix, counter)
+        lines.append('# HELP {} {}'.format(metric, _HELP[counter]))
+        lines.append('# TYPE {} counter'.format(metric))
+        for name, totals in names:
+            lines.append('{}{{name="{}"}} {}'.format(metric, _label(name), totals[counter]))
+
+    metric = '{}_resolution_depth'.format(prefix)
+    lines.append('# HELP {} Longest chain of factories run for one lookup.'.format(metric))
+    lines.append('# TYPE {} histogram'.format(metric))
+    depths = snapshot['resolution_depths']
+    total = 0
+    for depth in sorted(depths):
+        total += depths[depth]
+        lines.append('{}_bucket{{le="{}"}} {}'.format(metric, depth, total))
+    lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric, total))
+    lines.append('{}_sum {}'.format(metric, sum(d * n for d, n in depths.items())))
+    lines.append('{}_count {}'.format(metric, total))
+    return '\n'.join(lines) + '\n'
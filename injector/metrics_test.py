@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#pylint: disable=C0103
+
+from __future__ import absolute_import
+import threading
+import unittest
+
+from injector.metrics import CALLS, FAILURES, HITS, MISSES, Metrics
+
+class MetricsTest(unittest.TestCase):
+    def test_snapshot_adds_up_threads(self):
+        metrics = Metrics()
+        metrics.count('a', HITS)
+        metrics.record_depth(2)
+        def work():
+            metrics.count('a', HITS)
+            metrics.count('a', MISSES)
+            metrics.count('b', CALLS)
+            metrics.record_depth(2)
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+
+        self.assertEqual({
+            'names': {
+                'a': {'hits': 2, 'misses': 1, 'calls': 0, 'failures': 0},
+                'b': {'hits': 0, 'misses': 0, 'calls': 1, 'failures': 0},
+            },
+            'resolution_depths': {2: 2},
+        }, metrics.snapshot())
+
+    def test_keeps_counts_of_threads_that_have_exited(self):
+        metrics = Metrics()
+        def work():
+            metrics.count('a', CALLS)
+            metrics.record_depth(1)
+        for _ in range(50):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        metrics.count('a', HITS)
+
+        self.assertEqual(1, len(metrics._threads))
+        self.assertEqual({
+            'names': {'a': {'hits': 1, 'misses': 0, 'calls': 50, 'failures': 0}},
+            'resolution_depths': {1: 50},
+        }, metrics.snapshot())
+
+    def test_prometheus_text(self):
+        metrics = Metrics()
+        metrics.count('db "main"', FAILURES)
+        metrics.record_depth(1)
+        metrics.record_depth(3)
+        text = metrics.prometheus_text()
+
+        self.assertIn('# TYPE injector_failures_total counter\n', text)
+        self.assertIn('injector_failures_total{name="db \\"main\\""} 1\n', text)
+        self.assertIn('injector_hits_total{name="db \\"main\\""} 0\n', text)
+        self.assertIn('injector_resolution_depth_bucket{le="1"} 1\n', text)
+        self.assertIn('injector_resolution_depth_bucket{le="3"} 2\n', text)
+        self.assertIn('injector_resolution_depth_bucket{le="+Inf"} 2\n', text)
+        self.assertIn('injector_resolution_depth_sum 4\n', text)
+        self.assertIn('injector_resolution_depth_count 2\n', text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+from __future__ import absolute_import
+import collections
+import threading
+import time
+
+from injector import exceptions
+
+class Pool(object):
+    """ Hands out instances of something that can only be used by one caller at a time
+    (e.g. a database connection), building them as needed up to a bound.
+
+    This is the value of a name registered with `Dependencies.register_pool`, and
+    instances are normally taken with `Injector.checkout()`.
+    """
+
+    def __init__(self, create, size, max_idle=None, timeout=None, finalizer=None,
+                 clock=time.monotonic):
+        """
+        :param create: A function (with no arguments) that builds a new instance
+        :param size: The most instances to have at once
+        :param max_idle: (optional) Seconds an instance can go unused before it is
+                         dropped (by default, instances are kept until the pool closes)
+        :param timeout: (optional) Seconds to wait for an instance when they are all in
+                        use (by default, wait as long as it takes)
+        :param finalizer: (optional) A function to call with each instance that is
+                          dropped
+        :param clock: (optional) A function returning the current time in seconds, used
+                      for max_idle
+        """
+        if size < 1:
+            raise exceptions.PoolException("Pool size must be at least 1: {!r}".format(size))
+        self._create = create
+        self._size = size
+        self._max_idle = max_idle
+        self._timeout = timeout
+        self._finalizer = finalizer
+        self._clock = clock
+        self._condition = threading.Condition()
+        # (instance, time it was released), with the most recently used last
+        self._idle = collections.deque()
+        self._created = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._closed = False
+
+    def acquire(self):
+        """ Takes an instance, waiting for one to be released if they are all in use.
+
+        Idle instances are reused before new ones are built, most recently used first,
+        so that the rest can reach max_idle and be dropped.
+
+        :return: An instance, which must be passed to `release()` afterwards
+        :raises PoolException: if the pool is closed, or the timeout runs out
+        """
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        with self._condition:
+            expired = self._take_expired()
+        self._finalize(expired)
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise exceptions.PoolException("Pool is closed")
+                if self._idle:
+                    instance = self._idle.pop()[0]
+                    create = False
+                    break
+                if self._created < self._size:
+                    self._created += 1
+                    create = True
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._timeouts += 1
+                    raise exceptions.PoolException(
+                        "Timed out waiting for one of {} pooled instances".format(self._size))
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+            self._checkouts += 1
+        if create:
+            try:
+                instance = self._create()
+            except BaseException:
+                with self._condition:
+                    self._created -= 1
+                    self._in_use -= 1
+                    self._condition.notify()
+                raise
+        return instance
+
+    def release(self, instance):
+        """ Gives back an instance taken with `acquire()`.
+
+        :param instance: The instance
+        """
+        with self._condition:
+            self._in_use -= 1
+            closed = self._closed
+            if closed:
+                self._created -= 1
+            else:
+                self._idle.append((instance, self._clock()))
+            self._condition.notify()
+        if closed:
+            self._finalize([instance])
+
+    def close(self):
+        """ Drops the idle instances (and the others as they are released), and makes
+        any callers waiting for an instance raise `PoolException`.
+        """
+        with self._condition:
+            self._closed = True
+            idle = [instance for instance, _ in self._idle]
+            self._idle.clear()
+            self._created -= len(idle)
+            self._condition.notify_all()
+        self._finalize(idle)
+
+    def stats(self):
+        """ Describes how much the pool is being used.
+
+        :return: A dict with the keys 'size', 'created' (instances that exist now),
+                 'in_use', 'idle', 'waiting' (callers waiting for an instance),
+                 'checkouts' and 'timeouts' (totals so far), and 'utilization' (the
+                 fraction of the size that is in use).
+        """
+        with self._condition:
+            return {
+                'size': self._size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'utilization': self._in_use / self._size,
+            }
+
+    def _take_expired(self):
+        """ Removes the instances that have been idle too long (holding the condition).
+
+        :return: A list of the instances, to finalize after releasing the condition
+        """
+        expired = []
+        if self._max_idle is not None:
+            now = self._clock()
+            while self._idle and now - self._idle[0][1] > self._max_idle:
+                expired.append(self._idle.popleft()[0])
+            self._created -= len(expired)
+        return expired
+
+    def _finalize(self, instances):
+        if self._finalizer is not None:
+            for instance in instances:
+                self._finalizer(instance)
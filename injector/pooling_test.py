@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#pylint: disable=C0103
+
+from __future__ import absolute_import
+import threading
+import unittest
+
+from injector.caching_test import FakeClock
+from injector.exceptions import PoolException
+from injector.pooling import Pool
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+        self.dropped = []
+        self.clock = FakeClock()
+
+    def _create(self):
+        self.created.append(object())
+        return self.created[-1]
+
+    def _pool(self, size, **kwargs):
+        return Pool(self._create, size, finalizer=self.dropped.append, clock=self.clock,
+                    **kwargs)
+
+    def test_builds_instances_lazily_and_reuses_them(self):
+        pool = self._pool(2)
+        self.assertEqual([], self.created)
+        first = pool.acquire()
+        pool.release(first)
+        self.assertIs(first, pool.acquire())
+        second = pool.acquire()
+        self.assertIsNot(first, second)
+        self.assertEqual(2, len(self.created))
+
+    def test_times_out_when_exhausted(self):
+        pool = self._pool(1, timeout=0.01)
+        pool.acquire()
+        with self.assertRaises(PoolException):
+            pool.acquire()
+        self.assertEqual(1, pool.stats()['timeouts'])
+
+    def test_waits_for_released_instance(self):
+        pool = self._pool(1)
+        instance = pool.acquire()
+        got = []
+        thread = threading.Thread(target=lambda: got.append(pool.acquire()))
+        thread.start()
+        pool.release(instance)
+        thread.join()
+        self.assertEqual([instance], got)
+
+    def test_drops_idle_instances(self):
+        pool = self._pool(2, max_idle=10)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        self.clock.now = 5
+        pool.release(second)
+        self.clock.now = 12
+        self.assertIs(second, pool.acquire())
+        self.assertEqual([first], self.dropped)
+
+    def test_stats(self):
+        pool = self._pool(4)
+        pool.release(pool.acquire())
+        pool.acquire()
+        self.assertEqual({
+            'size': 4,
+            'created': 1,
+            'in_use': 1,
+            'idle': 0,
+            'waiting': 0,
+            'checkouts': 2,
+            'timeouts': 0,
+            'utilization': 0.25,
+        }, pool.stats())
+
+    def test_close(self):
+        pool = self._pool(2)
+        idle, in_use = pool.acquire(), pool.acquire()
+        pool.release(idle)
+        pool.close()
+        self.assertEqual([idle], self.dropped)
+        pool.release(in_use)
+        self.assertEqual([idle, in_use], self.dropped)
+        with self.assertRaises(PoolException):
+            pool.acquire()
+
+    def test_failed_create_frees_its_place(self):
+        pool = Pool(lambda: 1 / 0, 1, timeout=0)
+        for _ in range(2):
+            with self.assertRaises(ZeroDivisionError):
+                pool.acquire()
+        self.assertEqual(0, pool.stats()['created'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+
+class Lazy(str):
+    """ A dependency name marking that the dependency should be injected lazily """
+    pass
+
+def lazy(name):
+    """ Marks an entry in a list of dependencies as lazy.
+
+    Instead of the value, the function gets a `LazyProxy` that only builds the
+    value the first time it is used, e.g.
+    `deps.register_factory('handler', Handler, dependencies=['db', lazy('mailer')])`
+
+    :param name: The name of the dependency
+    :return: The name, marked as lazy
+    """
+    return Lazy(name)
+
+class LazyProxy(object):
+    """ Stands in for a dependency, and builds it the first time it is used.
+
+    Attribute access, calls and the common container operations are forwarded to
+    the value, which is fetched through the injector (so it is cached as usual).
+    """
+
+    __slots__ = ('_proxy_injector', '_proxy_name')
+
+    def __init__(self, injector, name):
+        object.__setattr__(self, '_proxy_injector', injector)
+        object.__setattr__(self, '_proxy_name', name)
+
+    def _proxy_resolve(self):
+        return self._proxy_injector.get_dependency(self._proxy_name)
+
+    def __getattr__(self, attr):
+        return getattr(self._proxy_resolve(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._proxy_resolve(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._proxy_resolve(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._proxy_resolve()(*args, **kwargs)
+
+    def __bool__(self):
+        return bool(self._proxy_resolve())
+
+    def __len__(self):
+        return len(self._proxy_resolve())
+
+    def __iter__(self):
+        return iter(self._proxy_resolve())
+
+    def __getitem__(self, key):
+        return self._proxy_resolve()[key]
+
+    def __contains__(self, item):
+        return item in self._proxy_resolve()
+
+    def __str__(self):
+        return str(self._proxy_resolve())
+
+    def __repr__(self):
+        return '<LazyProxy for {!r}>'.format(str(self._proxy_name))
@@ -0,0 +1,133 @@
+from __future__ import absolute_import
+import threading
+import time
+
+from injector import graph
+
+class Timings(object):
+    """ Records how long each factory takes to run. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._local = threading.local()
+
+    def call(self, name, function, args, started=None):
+        """ Calls a factory, recording how long it took and whether it raised.
+
+        The wall time runs from `started` (when the injector began building the
+        dependencies of the factory), so it includes the time taken to build them. The
+        self time only counts the factory itself, excluding the time spent building
+        other dependencies while it was running (e.g. through a lazy proxy).
+
+        :param name: The name of the dependency the factory builds
+        :param function: The factory function
+        :param args: A list of arguments to call it with
+        :param started: (optional) The `time.perf_counter()` when building the value
+                        began (by default, when the factory is called)
+        :return: The result of calling the function
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        failed = True
+        start = time.perf_counter()
+        try:
+            value = function(*args)
+            failed = False
+            return value
+        finally:
+            end = time.perf_counter()
+            call_time = end - start
+            nested_time = stack.pop()
+            if stack:
+                stack[-1] += call_time
+            wall_time = call_time if started is None else end - started
+            self.record(name, wall_time, call_time - nested_time, failed)
+
+    async def acall(self, name, function, args, is_async):
+        """ Like `call`, but awaits the result of async factories.
+
+        The time spent waiting on other tasks counts as self time.
+        """
+        failed = True
+        start = time.perf_counter()
+        try:
+            value = function(*args)
+            if is_async:
+                value = await value
+            failed = False
+            return value
+        finally:
+            wall_time = time.perf_counter() - start
+            self.record(name, wall_time, wall_time, failed)
+
+    def record(self, name, wall_time, self_time, failed=False):
+        """ Adds a measurement for a factory.
+
+        :param name: The name of the dependency
+        :param wall_time: Seconds taken to build the value, including its dependencies
+        :param self_time: Seconds taken by the factory itself
+        :param failed: True if the factory raised an exception
+        """
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {
+                    'calls': 0,
+                    'errors': 0,
+                    'wall_time': 0.0,
+                    'self_time': 0.0,
+                }
+            stats['calls'] += 1
+            stats['errors'] += int(failed)
+            stats['wall_time'] += wall_time
+            stats['self_time'] += self_time
+
+    def snapshot(self):
+        """ Gets a copy of the measurements.
+
+        :return: A dict of {name: {'calls', 'errors', 'wall_time', 'self_time'}}
+        """
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+def startup_report(stats, dependencies):
+    """ Summarizes the measurements, finding the chain of factories that took longest.
+
+    :param stats: Measurements, as returned by `Timings.snapshot()`
+    :param dependencies: A dict mapping each name to a list of names it depends on
+    :return: A dict with the keys 'factories' (the measurements), 'total_time' (the
+             sum of the self times), 'critical_path' (the list of names on the slowest
+             chain of dependencies, starting with the one built first) and
+             'critical_path_time' (the sum of the self times along it).
+    """
+    compact = graph.CompactGraph({name: dependencies.get(name) or () for name in stats})
+    finish_times = {}
+    slowest_dependency = {}
+    for level in compact.levels():
+        for name in (compact.names[i] for i in level):
+            previous = None
+            for dependency in dependencies.get(name) or ():
+                if dependency in finish_times and (
+                        previous is None or finish_times[dependency] > finish_times[previous]):
+                    previous = dependency
+            slowest_dependency[name] = previous
+            start = finish_times[previous] if previous is not None else 0.0
+            finish_times[name] = start + stats[name]['self_time']
+
+    path = []
+    name = max(finish_times, key=finish_times.get) if finish_times else None
+    critical_path_time = finish_times[name] if name is not None else 0.0
+    while name is not None:
+        path.append(name)
+        name = slowest_dependency[name]
+    path.reverse()
+
+    return {
+        'factories': stats,
+        'total_time': sum(s['self_time'] for s in stats.values()),
+        'critical_path': path,
+        'critical_path_time': critical_path_time,
+    }
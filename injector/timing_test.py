@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#pylint: disable=C0103
+
+from __future__ import absolute_import
+import unittest
+
+from injector.timing import Timings, startup_report
+
+def _stats(self_time):
+    return {'calls': 1, 'errors': 0, 'wall_time': self_time, 'self_time': self_time}
+
+class TimingsTest(unittest.TestCase):
+    def test_records_calls(self):
+        timings = Timings()
+        self.assertEqual(3, timings.call('x', lambda a, b: a + b, [1, 2]))
+        timings.call('x', lambda: None, [])
+
+        stats = timings.snapshot()['x']
+        self.assertEqual(2, stats['calls'])
+        self.assertEqual(0, stats['errors'])
+        self.assertGreaterEqual(stats['wall_time'], stats['self_time'])
+
+    def test_records_errors(self):
+        timings = Timings()
+        with self.assertRaises(ZeroDivisionError):
+            timings.call('x', lambda: 1 / 0, [])
+        self.assertEqual(1, timings.snapshot()['x']['errors'])
+
+    def test_self_time_excludes_nested_calls(self):
+        timings = Timings()
+        def outer():
+            return timings.call('inner', sum, [range(100000)])
+        timings.call('outer', outer, [])
+
+        stats = timings.snapshot()
+        self.assertLess(stats['outer']['self_time'], stats['outer']['wall_time'])
+        self.assertGreaterEqual(stats['outer']['wall_time'], stats['inner']['wall_time'])
+
+class StartupReportTest(unittest.TestCase):
+    def test_empty_report(self):
+        report = startup_report({}, {})
+        self.assertEqual([], report['critical_path'])
+        self.assertEqual(0.0, report['total_time'])
+
+    def test_finds_critical_path(self):
+        stats = {
+            'a': _stats(1.0),
+            'b': _stats(5.0),
+            'c': _stats(2.0),
+            'd': _stats(1.0),
+        }
+        report = startup_report(stats, {
+            'a': [],
+            'b': [],
+            'c': ['a', 'b'],
+            'd': ['c', 'not-built'],
+        })
+        self.assertEqual(['b', 'c', 'd'], report['critical_path'])
+        self.assertEqual(8.0, report['critical_path_time'])
+        self.assertEqual(9.0, report['total_time'])
+
+if __name__ == '__main__':
+    unittest.main()
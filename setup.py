@@ -5,9 +5,10 @@ import setuptools
 setuptools.setup(
     name='dep_injector',
     version='1.0.0',
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks']),
     author='Jeremy Mikkola',
     description='A dependency injector backend',
     install_requires=[],
+    python_requires='>=3.7',
     test_suite='nose.collector',
 )